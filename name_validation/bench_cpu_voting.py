@@ -0,0 +1,108 @@
+import argparse
+import time
+import numpy as np
+import torch
+from name_embedding import (
+    NameEmbeddingService,
+    StaticNameEmbeddingService,
+    load_codebert,
+    load_static_embeddings,
+)
+
+
+def parse_args():
+    args = argparse.ArgumentParser(
+        description="CPU throughput and int8/static parity of the voting embeddings"
+    )
+    args.add_argument("--names-txt", type=str, required=True, help="one name per line")
+    args.add_argument("--num-names", type=int, default=20000)
+    args.add_argument("--num-threads", type=int, default=0)
+    args.add_argument("--emb-batch-size", type=int, default=1024)
+    args.add_argument(
+        "--group-size",
+        type=int,
+        default=8,
+        help="names per synthetic variable when checking voting parity",
+    )
+    args.add_argument(
+        "--static-emb-table",
+        type=str,
+        default="",
+        help=".npy cache of the token embedding table for the static backend",
+    )
+    args = args.parse_args()
+
+    return args
+
+
+def embed(names, num_threads, quantize, batch_size):
+    tokenizer, model = load_codebert("cpu", num_threads=num_threads, quantize=quantize)
+    embedder = NameEmbeddingService(tokenizer, model, batch_size=batch_size)
+    embedder.add_names(names)
+    start = time.time()
+    embedder.embed_all()
+    elapsed = time.time() - start
+    return np.asarray(embedder.matrix), elapsed
+
+
+def embed_static(names, static_emb_table, batch_size):
+    tokenizer, table = load_static_embeddings(static_emb_table)
+    embedder = StaticNameEmbeddingService(tokenizer, table, batch_size=batch_size)
+    embedder.add_names(names)
+    start = time.time()
+    embedder.embed_all()
+    elapsed = time.time() - start
+    return np.asarray(embedder.matrix), elapsed
+
+
+def report_agreement(label, votes, reference_votes):
+    agree = sum(1 for a, b in zip(votes, reference_votes) if a == b)
+    print(
+        "Voting agreement (%s vs float32): %d/%d (%.4f)"
+        % (label, agree, len(reference_votes), agree / max(len(reference_votes), 1))
+    )
+
+
+def vote(matrix, group_size):
+    selections = []
+    for start in range(0, matrix.shape[0] - group_size + 1, group_size):
+        group = torch.from_numpy(matrix[start : start + group_size])
+        scores = torch.mean(torch.matmul(group, group.transpose(0, 1)), dim=-1)
+        selections.append(int(torch.argmax(scores)))
+    return selections
+
+
+def main():
+    args = parse_args()
+    names = []
+    seen = set()
+    for line in open(args.names_txt, "r"):
+        name = line.strip()
+        if name == "" or name in seen:
+            continue
+        seen.add(name)
+        names.append(name)
+        if len(names) >= args.num_names:
+            break
+
+    float_matrix, float_time = embed(
+        names, args.num_threads, False, args.emb_batch_size
+    )
+    int8_matrix, int8_time = embed(names, args.num_threads, True, args.emb_batch_size)
+    static_matrix, static_time = embed_static(
+        names, args.static_emb_table, args.emb_batch_size
+    )
+    print("Threads: %d" % torch.get_num_threads())
+    print("float32: %.1f names/s" % (len(names) / float_time))
+    print("int8:    %.1f names/s" % (len(names) / int8_time))
+    print("static:  %.1f names/s" % (len(names) / static_time))
+
+    cosine = np.sum(float_matrix * int8_matrix, axis=-1)
+    print("Cosine(float32, int8): mean %.4f, min %.4f" % (cosine.mean(), cosine.min()))
+    float_votes = vote(float_matrix, args.group_size)
+    report_agreement("int8", vote(int8_matrix, args.group_size), float_votes)
+    report_agreement("static", vote(static_matrix, args.group_size), float_votes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+import networkx as nx
+import torch
+import lmpa_ir
+import binary_prog
+import prop_names
+from name_embedding import NameEmbeddingService
+from prop_metrics import PropMetrics
+
+
+RULES = [
+    "_from_callee_args",
+    "_from_callee_return",
+    "_from_caller_args",
+    "_from_caller_return",
+    "_among_direct_use(rhs)",
+    "_among_direct_use(lhs)",
+]
+
+
+def parse_args():
+    args = argparse.ArgumentParser(
+        description="Benchmark propagation and voting on synthetic programs"
+    )
+    args.add_argument(
+        "--num-funcs",
+        type=str,
+        default="100,200,400,800",
+        help="comma separated function counts, one synthetic program each",
+    )
+    args.add_argument("--fan-out", type=int, default=3, help="callees per function")
+    args.add_argument("--num-params", type=int, default=3)
+    args.add_argument(
+        "--chain-len", type=int, default=8, help="length of the var = var chain"
+    )
+    args.add_argument("--num-candidates", type=int, default=5, help="K names per var")
+    args.add_argument("--vocab-size", type=int, default=2000)
+    args.add_argument("--prop_round", type=int, default=1)
+    args.add_argument("--seed", type=int, default=42)
+    args.add_argument("--json-out", type=str, default="")
+    args = args.parse_args()
+
+    return args
+
+
+def _new(cls, **attrs):
+    # build IR nodes without depending on the constructors' signatures
+    obj = cls.__new__(cls)
+    for k, v in attrs.items():
+        setattr(obj, k, v)
+    return obj
+
+
+def _var(name):
+    return _new(lmpa_ir.LmPaVarExpression, var_name=name)
+
+
+def gen_program(prog_name, num_funcs, fan_out, num_params, chain_len, rng):
+    """
+    A program of `num_funcs` functions. Each function passes its params down
+    an assignment chain, calls `fan_out` random callees with chain vars as
+    arguments, assigns each callee's return value and returns its last var.
+    """
+    func_names = ["sub_%x" % (0x1000 + i * 0x10) for i in range(num_funcs)]
+    call_graph = nx.DiGraph()
+    call_graph.add_nodes_from(func_names)
+    stripped_name2func = {}
+    stripped_name2parsed = {}
+    for func_name in func_names:
+        params = ["a%d" % (i + 1) for i in range(num_params)]
+        chain = ["v%d" % (i + 1) for i in range(chain_len)]
+        exprs = []
+        prev = params[0]
+        for var in chain:
+            exprs.append(
+                _new(
+                    lmpa_ir.LmPaBasicExpr,
+                    defs=[_var(var)],
+                    uses=[_var(prev)],
+                    is_direct_use=True,
+                )
+            )
+            prev = var
+        callees = rng.sample(func_names, min(fan_out, num_funcs))
+        for i, callee in enumerate(callees):
+            call_graph.add_edge(func_name, callee)
+            args = [_var(rng.choice(params + chain)) for _ in range(num_params)]
+            exprs.append(_new(lmpa_ir.LmPaCallExpr, func_id=callee, args=args))
+            ret_var = "r%d" % (i + 1)
+            exprs.append(
+                _new(
+                    lmpa_ir.LmPaBasicExpr,
+                    defs=[_var(ret_var)],
+                    uses=[
+                        _new(
+                            lmpa_ir.LmPaImplicitReturnVarExpr,
+                            func_id=callee,
+                            var_name=callee + "_ret",
+                        )
+                    ],
+                    is_direct_use=True,
+                )
+            )
+        exprs.append(_new(lmpa_ir.LmPaReturnStmt, ret_val=_var(chain[-1])))
+        stripped_name2parsed[func_name] = {
+            "prog_name": prog_name,
+            "func_name": func_name,
+            "lmpa_args": [_var(p) for p in params],
+            "lmpa_exprs": exprs,
+        }
+        var_names = params + chain + ["r%d" % (i + 1) for i in range(len(callees))]
+        stripped_name2func[func_name] = binary_prog.Function(
+            func_name, "", {v: v for v in var_names}, {}
+        )
+    prog = binary_prog.BinaryProgram.__new__(binary_prog.BinaryProgram)
+    prog.prog_name = prog_name
+    prog.call_graph = call_graph
+    prog.stripped_name2func = stripped_name2func
+    return prog, stripped_name2parsed
+
+
+def gen_names(prog, vocab, num_candidates, rng):
+    names = {}
+    for func_name, func in prog.stripped_name2func.items():
+        for var_name in func.var_id_maps.keys():
+            k = (prog.prog_name, func_name, var_name)
+            names[k] = {
+                "prog_name": prog.prog_name,
+                "func_name": func_name,
+                "varname": var_name,
+                "name_list": [
+                    {"pred_name": rng.choice(vocab), "precision": rng.random()}
+                    for _ in range(num_candidates)
+                ],
+            }
+    return names
+
+
+class CharTokenizer:
+    """
+    Stand-in for the CodeBERT tokenizer: one id per character
+    """
+
+    def __init__(self, max_len=32):
+        self.max_len = max_len
+
+    def __call__(self, names, truncation=True):
+        input_ids = [[1] + [2 + (ord(c) % 254) for c in name] for name in names]
+        if truncation:
+            input_ids = [ids[: self.max_len] for ids in input_ids]
+        return {"input_ids": input_ids}
+
+    def pad(self, batch, return_tensors="pt"):
+        input_ids = batch["input_ids"]
+        max_len = max(len(ids) for ids in input_ids)
+        padded = torch.zeros((len(input_ids), max_len), dtype=torch.long)
+        mask = torch.zeros((len(input_ids), max_len), dtype=torch.long)
+        for i, ids in enumerate(input_ids):
+            padded[i, : len(ids)] = torch.tensor(ids)
+            mask[i, : len(ids)] = 1
+        return {"input_ids": padded, "attention_mask": mask}
+
+
+class TinyEncoder(torch.nn.Module):
+    """
+    Stand-in for CodeBERT: embedding + one linear layer, masked mean in the
+    first position so the service can keep reading `[:, 0, :]`
+    """
+
+    def __init__(self, hidden_size=64):
+        super().__init__()
+        self.config = SimpleNamespace(hidden_size=hidden_size)
+        self.emb = torch.nn.Embedding(256, hidden_size)
+        self.proj = torch.nn.Linear(hidden_size, hidden_size)
+
+    def forward(self, input_ids, attention_mask):
+        hidden = self.proj(self.emb(input_ids))
+        mask = attention_mask.unsqueeze(-1).float()
+        pooled = (hidden * mask).sum(dim=1, keepdim=True) / mask.sum(dim=1, keepdim=True)
+        return SimpleNamespace(last_hidden_state=pooled)
+
+
+def bench_one(num_funcs, args, vocab, rng):
+    prog, stripped_name2parsed = gen_program(
+        "bench_%d" % num_funcs,
+        num_funcs,
+        args.fan_out,
+        args.num_params,
+        args.chain_len,
+        rng,
+    )
+    names = gen_names(prog, vocab, args.num_candidates, rng)
+    metrics = PropMetrics()
+    vote_stats = prop_names.NameVoteStats(names)
+
+    begin = time.perf_counter()
+    prog_records = prop_names.propagate_prog(
+        prog, stripped_name2parsed, vote_stats, args.prop_round, metrics=metrics
+    )
+    prop_seconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    new_names = prop_names.collect_new_names(prog_records, names)
+    filtered_new_names = prop_names._filter_new_names(new_names, vote_stats)
+    embedder = NameEmbeddingService(CharTokenizer(), TinyEncoder().eval(), metrics=metrics)
+    selections, _ = prop_names.select_names(
+        list(names.keys()), names, {}, filtered_new_names, embedder, False
+    )
+    vote_seconds = time.perf_counter() - begin
+
+    return {
+        "num_funcs": num_funcs,
+        "num_vars": len(names),
+        "num_records": len(prog_records),
+        "num_entries": sum(len(r.propagation_list) for r in prog_records.values()),
+        "num_voted": len(filtered_new_names),
+        "rules": {
+            rule: metrics.timings.get("rule/" + rule, [0, 0.0])[1] for rule in RULES
+        },
+        "propagation_seconds": prop_seconds,
+        "voting_seconds": vote_seconds,
+        "num_selected": len(selections),
+    }
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    torch.manual_seed(args.seed)
+    if not hasattr(prop_names, "_collect_all_exprs"):
+        # the IR walker is not part of this snapshot; synthetic records
+        # already carry their flattened expression list
+        prop_names._collect_all_exprs = lambda parsed: parsed["lmpa_exprs"]
+    vocab = ["name_%d" % i for i in range(args.vocab_size)]
+
+    results = []
+    for num_funcs in [int(n) for n in args.num_funcs.split(",")]:
+        results.append(bench_one(num_funcs, args, vocab, rng))
+
+    header = ["funcs", "vars", "entries"] + RULES + ["propagation", "voting"]
+    print("\t".join(header))
+    for r in results:
+        row = [str(r["num_funcs"]), str(r["num_vars"]), str(r["num_entries"])]
+        row += ["%.3f" % r["rules"][rule] for rule in RULES]
+        row += ["%.3f" % r["propagation_seconds"], "%.3f" % r["voting_seconds"]]
+        print("\t".join(row))
+    if args.json_out:
+        json.dump(results, open(args.json_out, "w"), indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import json
+import os
+import pickle
+
+
+def file_signature(path):
+    """
+    Path, size and mtime of a run input, so that a checkpoint is not resumed
+    against a file that was rewritten in place
+    """
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+class RunCheckpoint:
+    """
+    Progress of a streaming prop_names run: the programs whose selections are
+    fully written, the size of the output file at that point and the running
+    statistics. Completed programs are appended to a log next to `path`, so
+    saving after a flush costs the programs of that flush only; the state
+    file, replaced atomically, records how much of the log is committed.
+    """
+
+    def __init__(self, path, run_signature):
+        self.path = path
+        self.run_signature = run_signature
+        self.progs_size = 0
+
+    def _progs_file(self):
+        return self.path + ".progs.jsonl"
+
+    def reset(self):
+        """
+        Forget the progress of an earlier run
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        open(self._progs_file(), "w").close()
+        self.progs_size = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as fin:
+            state = pickle.load(fin)
+        if state["run_signature"] != self.run_signature:
+            raise ValueError(
+                "Checkpoint %s was written by a run with different arguments: %s"
+                % (self.path, str(state["run_signature"]))
+            )
+        # programs logged after the last saved state are not committed
+        self.progs_size = state["progs_size"]
+        os.truncate(self._progs_file(), self.progs_size)
+        with open(self._progs_file(), "r") as fin:
+            state["completed_progs"] = [json.loads(line) for line in fin]
+        return state
+
+    def save(self, new_progs, fout_offset, stats):
+        with open(self._progs_file(), "a") as fout:
+            fout.seek(self.progs_size)
+            fout.truncate()
+            for prog_name in new_progs:
+                fout.write(json.dumps(prog_name) + "\n")
+            fout.flush()
+            os.fsync(fout.fileno())
+            progs_size = fout.tell()
+        with open(self.path + ".tmp", "wb") as fout:
+            pickle.dump(
+                {
+                    "run_signature": self.run_signature,
+                    "progs_size": progs_size,
+                    "fout_offset": fout_offset,
+                    "stats": stats,
+                },
+                fout,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(self.path + ".tmp", self.path)
+        self.progs_size = progs_size
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import pickle
+
+
+class IncrementalCache:
+    """
+    Per-program cache of propagation records and name selections. An entry
+    is reused only while the fingerprint of the program's inputs (IR, call
+    graph, name lists and run config) is unchanged.
+    """
+
+    def __init__(self, cache_dir, run_config):
+        self.cache_dir = cache_dir
+        self.run_config = run_config
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, prog_name):
+        digest = hashlib.sha1(prog_name.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".pkl")
+
+    def fingerprint(self, prog, stripped_name2parsed, prog_keys, names, default_names):
+        h = hashlib.sha1()
+        h.update(pickle.dumps(self.run_config, protocol=4))
+        if prog is not None:
+            h.update(pickle.dumps(sorted(prog.stripped_name2func.keys()), protocol=4))
+            h.update(pickle.dumps(sorted(prog.call_graph.edges()), protocol=4))
+        for func_name in sorted(stripped_name2parsed.keys()):
+            h.update(pickle.dumps(stripped_name2parsed[func_name], protocol=4))
+        for k in sorted(prog_keys):
+            h.update(pickle.dumps((k, names[k]["name_list"]), protocol=4))
+            h.update(pickle.dumps(default_names.get(k), protocol=4))
+        return h.hexdigest()
+
+    def load(self, prog_name, fingerprint):
+        path = self._path(prog_name)
+        if os.path.exists(path):
+            with open(path, "rb") as fin:
+                entry = pickle.load(fin)
+            if entry["prog_name"] == prog_name and entry["fingerprint"] == fingerprint:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def store(self, prog_name, fingerprint, propagation_records, selections):
+        path = self._path(prog_name)
+        with open(path + ".tmp", "wb") as fout:
+            pickle.dump(
+                {
+                    "prog_name": prog_name,
+                    "fingerprint": fingerprint,
+                    "propagation_records": propagation_records,
+                    "selections": selections,
+                },
+                fout,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,366 @@
+import json
+import os
+import time
+import numpy as np
+import torch
+from tqdm import tqdm
+from transformers import AutoModel, AutoTokenizer
+
+
+CODEBERT_NAME = "microsoft/codebert-base"
+
+
+def resolve_device(device):
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def load_codebert(device="auto", num_threads=0, quantize=False):
+    """
+    Load CodeBERT for voting on `device`. On CPU, `num_threads` sets the
+    intra-op thread pool (0 keeps torch's default) and `quantize` swaps the
+    Linear layers for dynamic int8 ones.
+    """
+    device = resolve_device(device)
+    tokenizer = AutoTokenizer.from_pretrained(CODEBERT_NAME)
+    model = AutoModel.from_pretrained(CODEBERT_NAME).eval()
+    if device == "cpu":
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        if quantize:
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+    elif quantize:
+        raise ValueError("dynamic int8 quantization is only supported on cpu")
+    return tokenizer, model.to(device)
+
+
+def load_static_embeddings(cache_path=""):
+    """
+    The CodeBERT tokenizer and its input token-embedding table as a float32
+    matrix. The table is saved to `cache_path` (.npy) on first use and
+    mmap'd from there afterwards, so the model is loaded at most once.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(CODEBERT_NAME)
+    if cache_path and os.path.exists(cache_path):
+        return tokenizer, np.load(cache_path, mmap_mode="r")
+    model = AutoModel.from_pretrained(CODEBERT_NAME)
+    table = model.get_input_embeddings().weight.detach().float().numpy()
+    del model
+    if cache_path:
+        np.save(cache_path, table)
+    return tokenizer, table
+
+
+class NameEmbeddingService:
+    """
+    Embed every distinct name string once and keep all embeddings in one
+    contiguous (optionally mmap'd) matrix, so voting is a row lookup. Rows
+    are only ever appended: in memory into blocks that double in capacity,
+    and with `emb_file` to the end of the file and its names list.
+    `cache_config` (e.g. the model id and quantization) is stored next to
+    `emb_file`, which is refused when opened under another config. Without
+    `emb_file`, release() keeps only the `max_rows` most recently used rows.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        model,
+        batch_size=1024,
+        emb_file=None,
+        metrics=None,
+        cache_config=None,
+        max_rows=32768,
+    ):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.batch_size = batch_size
+        self.emb_file = emb_file
+        self.metrics = metrics
+        self.cache_config = cache_config
+        self.max_rows = max_rows
+        self.name2idx = {}
+        self.names = []
+        self.matrix = None
+        self._rows = None
+        # the release() round each name was last looked up in
+        self._epoch = 0
+        self._last_used = []
+        # names whose rows release() dropped, to count re-embeddings
+        self._evicted = set()
+        if emb_file:
+            self._check_cache_config()
+            if os.path.exists(emb_file):
+                self._load()
+
+    def _names_file(self):
+        return self.emb_file + ".names.jsonl"
+
+    def _config_file(self):
+        return self.emb_file + ".config.json"
+
+    def _check_cache_config(self):
+        config = dict(self.cache_config or {}, hidden_size=self._hidden_size())
+        if os.path.exists(self._config_file()):
+            cached_config = json.load(open(self._config_file(), "r"))
+            if cached_config != config:
+                raise ValueError(
+                    "Embedding cache %s was written with %s, not %s"
+                    % (self.emb_file, str(cached_config), str(config))
+                )
+        elif os.path.exists(self.emb_file):
+            raise ValueError(
+                "Embedding cache %s has no %s, the model that wrote it is unknown"
+                % (self.emb_file, self._config_file())
+            )
+        else:
+            json.dump(config, open(self._config_file(), "w"))
+
+    def _load(self):
+        hidden_size = self._hidden_size()
+        num_rows = os.path.getsize(self.emb_file) // (4 * hidden_size)
+        names = []
+        if os.path.exists(self._names_file()):
+            with open(self._names_file(), "r") as fin:
+                for line in fin:
+                    if not line.endswith("\n") or len(names) == num_rows:
+                        break
+                    names.append(json.loads(line))
+        # an interrupted append leaves more rows than names or a partial
+        # names line behind; keep the prefix both agree on
+        self.names = names
+        self.name2idx = {name: i for i, name in enumerate(names)}
+        self._last_used = [0] * len(names)
+        self._truncate_files(len(names))
+        self._map_file()
+
+    def _truncate_files(self, num_rows):
+        os.truncate(self.emb_file, num_rows * 4 * self._hidden_size())
+        with open(self._names_file(), "a") as fout:
+            fout.truncate(
+                sum(len(json.dumps(name)) + 1 for name in self.names)
+            )
+
+    def _map_file(self):
+        if len(self.names) == 0:
+            self.matrix = None
+            return
+        self.matrix = np.memmap(
+            self.emb_file,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(self.names), self._hidden_size()),
+        )
+
+    def _hidden_size(self):
+        return self.model.config.hidden_size
+
+    def _tokenize(self, names):
+        return self.tokenizer(names, truncation=True)["input_ids"]
+
+    def add_names(self, names):
+        num_embedded = 0 if self.matrix is None else self.matrix.shape[0]
+        num_reused = 0
+        for name in names:
+            if name not in self.name2idx:
+                self.name2idx[name] = len(self.names)
+                self.names.append(name)
+                self._last_used.append(self._epoch)
+                continue
+            idx = self.name2idx[name]
+            self._last_used[idx] = self._epoch
+            if idx < num_embedded:
+                num_reused += 1
+        if self.metrics is not None:
+            self.metrics.count("embedding/lookups", len(names))
+            # names that already have a row, from --emb-cache or an earlier batch
+            self.metrics.count("embedding/cache_hits", num_reused)
+
+    def index(self, names):
+        return np.array([self.name2idx[name] for name in names], dtype=np.int64)
+
+    def lookup(self, names):
+        return torch.from_numpy(np.ascontiguousarray(self.matrix[self.index(names)]))
+
+    def _embed_batch(self, input_ids):
+        device = next(self.model.parameters()).device
+        padded = self.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+        padded = {k: v.to(device) for k, v in padded.items()}
+        if self.metrics is not None:
+            self.metrics.record_batch(len(input_ids), padded["input_ids"].shape[1])
+        with torch.inference_mode():
+            embs = self.model(**padded).last_hidden_state[:, 0, :]
+            embs = embs / embs.norm(dim=-1, keepdim=True)
+        return embs.float().cpu().numpy()
+
+    def embed_all(self):
+        """
+        Embed all registered names that have no row yet. Names are sorted by
+        token length before batching so each batch carries little padding.
+        """
+        num_done = 0 if self.matrix is None else self.matrix.shape[0]
+        pending = self.names[num_done:]
+        if len(pending) == 0:
+            return
+        input_ids = self._tokenize(pending)
+        order = sorted(range(len(pending)), key=lambda i: len(input_ids[i]))
+        hidden_size = self._hidden_size()
+        new_rows = np.zeros((len(pending), hidden_size), dtype=np.float32)
+        embed_begin = time.perf_counter()
+        for start in tqdm(
+            range(0, len(order), self.batch_size), desc="Embedding names"
+        ):
+            batch_idx = order[start : start + self.batch_size]
+            new_rows[batch_idx] = self._embed_batch([input_ids[i] for i in batch_idx])
+        if self.metrics is not None:
+            self.metrics.span("embedding/forward", embed_begin, num_names=len(pending))
+            self.metrics.count("embedding/names_embedded", len(pending))
+            # forward passes spent on rows release() had dropped
+            reembedded = [name for name in pending if name in self._evicted]
+            self._evicted.difference_update(reembedded)
+            self.metrics.count("embedding/reembedded", len(reembedded))
+
+        if self.emb_file:
+            with open(self.emb_file, "ab") as fout:
+                fout.write(new_rows.tobytes())
+            with open(self._names_file(), "a") as fout:
+                for name in pending:
+                    fout.write(json.dumps(name) + "\n")
+            self._map_file()
+        else:
+            self._append_rows(num_done, new_rows)
+
+    def _append_rows(self, num_done, new_rows):
+        num_rows = num_done + len(new_rows)
+        if self._rows is None or self._rows.shape[0] < num_rows:
+            capacity = max(num_rows, 2 * (0 if self._rows is None else self._rows.shape[0]))
+            rows = np.zeros((capacity, new_rows.shape[1]), dtype=np.float32)
+            if num_done > 0:
+                rows[:num_done] = self._rows[:num_done]
+            self._rows = rows
+        self._rows[num_done:num_rows] = new_rows
+        self.matrix = self._rows[:num_rows]
+
+    def release(self):
+        """
+        Shrink the rows held in memory to the `max_rows` most recently used
+        ones, so names common across batches are not embedded again. Rows
+        backed by `emb_file` are all kept, they live in the page cache
+        rather than on the heap and are reused by later batches and runs.
+        """
+        if self.emb_file:
+            return
+        self._epoch += 1
+        num_embedded = 0 if self.matrix is None else self.matrix.shape[0]
+        if num_embedded <= self.max_rows and len(self.names) == num_embedded:
+            return
+        last_used = np.array(self._last_used[:num_embedded], dtype=np.int64)
+        keep = np.sort(np.argsort(-last_used, kind="stable")[: self.max_rows])
+        if self.metrics is not None:
+            kept = set(keep.tolist())
+            self._evicted.update(
+                self.names[i] for i in range(num_embedded) if i not in kept
+            )
+            self.metrics.count("embedding/evicted", num_embedded - len(keep))
+        self.names = [self.names[i] for i in keep]
+        self._last_used = [self._last_used[i] for i in keep]
+        self.name2idx = {name: i for i, name in enumerate(self.names)}
+        if len(keep) == 0:
+            self.matrix = None
+            self._rows = None
+        else:
+            self._rows = np.ascontiguousarray(self.matrix[keep])
+            self.matrix = self._rows
+
+
+class StaticNameEmbeddingService(NameEmbeddingService):
+    """
+    Embed a name as the normalized mean of its tokens' rows in the input
+    token-embedding table (see load_static_embeddings), with no transformer
+    forward pass
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        table,
+        batch_size=1024,
+        emb_file=None,
+        metrics=None,
+        cache_config=None,
+        max_rows=32768,
+    ):
+        self.table = table
+        super().__init__(
+            tokenizer, None, batch_size, emb_file, metrics, cache_config, max_rows
+        )
+
+    def _hidden_size(self):
+        return self.table.shape[1]
+
+    def _tokenize(self, names):
+        input_ids = self.tokenizer(names, add_special_tokens=False)["input_ids"]
+        return [ids if len(ids) > 0 else [self.tokenizer.unk_token_id] for ids in input_ids]
+
+    def _embed_batch(self, input_ids):
+        lengths = np.array([len(ids) for ids in input_ids], dtype=np.int64)
+        if self.metrics is not None:
+            self.metrics.record_batch(len(input_ids), int(lengths.max()))
+        flat = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in input_ids])
+        starts = np.cumsum(lengths) - lengths
+        embs = np.add.reduceat(np.asarray(self.table[flat], dtype=np.float32), starts, axis=0)
+        embs = embs / lengths[:, None]
+        embs = embs / np.linalg.norm(embs, axis=-1, keepdims=True)
+        return embs.astype(np.float32)
+
+
+def batched_vote(
+    matrix, cand_idx, cand_offsets, voter_idx, voter_offsets, chunk_size=65536
+):
+    """
+    Vote for many variables at once. Variable i owns candidate rows
+    cand_idx[cand_offsets[i]:cand_offsets[i + 1]] and voter rows
+    voter_idx[voter_offsets[i]:voter_offsets[i + 1]] of the (normalized)
+    embedding matrix. A candidate's score is its mean similarity to the
+    voters, i.e. its dot product with the voters' segment-mean. Returns the
+    position (within its own candidate list) of the best candidate of each
+    variable; ties go to the earliest candidate.
+    """
+    num_vars = len(cand_offsets) - 1
+    selections = np.zeros(num_vars, dtype=np.int64)
+    for start in range(0, num_vars, chunk_size):
+        end = min(start + chunk_size, num_vars)
+        c_lo, c_hi = cand_offsets[start], cand_offsets[end]
+        v_lo, v_hi = voter_offsets[start], voter_offsets[end]
+        cand_embs = torch.from_numpy(np.ascontiguousarray(matrix[cand_idx[c_lo:c_hi]]))
+        voter_embs = torch.from_numpy(
+            np.ascontiguousarray(matrix[voter_idx[v_lo:v_hi]])
+        )
+        cand_counts = torch.from_numpy(np.diff(cand_offsets[start : end + 1]))
+        voter_counts = torch.from_numpy(np.diff(voter_offsets[start : end + 1]))
+        segments = torch.arange(end - start)
+        cand_seg = torch.repeat_interleave(segments, cand_counts)
+        voter_seg = torch.repeat_interleave(segments, voter_counts)
+
+        with torch.inference_mode():
+            centroids = torch.zeros(end - start, matrix.shape[1])
+            centroids.index_add_(0, voter_seg, voter_embs)
+            centroids = centroids / voter_counts.unsqueeze(-1).float()
+            scores = (cand_embs * centroids[cand_seg]).sum(dim=-1)
+
+            seg_max = torch.full((end - start,), float("-inf"))
+            seg_max = seg_max.scatter_reduce(0, cand_seg, scores, reduce="amax")
+            positions = torch.arange(c_hi - c_lo)
+            positions = torch.where(
+                scores == seg_max[cand_seg],
+                positions,
+                torch.full_like(positions, c_hi - c_lo),
+            )
+            first = torch.full((end - start,), c_hi - c_lo, dtype=torch.int64)
+            first = first.scatter_reduce(0, cand_seg, positions, reduce="amin")
+        local_offsets = torch.from_numpy(cand_offsets[start:end] - c_lo)
+        selections[start:end] = (first - local_offsets).numpy()
+    return selections
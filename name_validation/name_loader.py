@@ -0,0 +1,82 @@
+import ast
+import json
+import os
+import pickle
+import sys
+import time
+from tqdm import tqdm
+
+
+CACHE_VERSION = 1
+
+
+def parse_name_list(raw):
+    """
+    `name_list` is dumped either as JSON or as a Python literal (repr of a
+    list of dicts); never evaluate it as code
+    """
+    if type(raw) != str:
+        return raw
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return ast.literal_eval(raw)
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return (CACHE_VERSION, os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def _read_table(path, with_name_list, desc):
+    table = {}
+    with open(path, "r") as fin:
+        for line in tqdm(fin, desc=desc):
+            entry = json.loads(line)
+            prog_name = sys.intern(entry["prog_name"])
+            func_name = sys.intern(entry["func_name"])
+            varname = sys.intern(entry["varname"])
+            entry["prog_name"] = prog_name
+            entry["func_name"] = func_name
+            entry["varname"] = varname
+            if with_name_list:
+                name_list = parse_name_list(entry["name_list"])
+                for name_entry in name_list:
+                    name_entry["pred_name"] = sys.intern(name_entry["pred_name"])
+                entry["name_list"] = name_list
+            table[(prog_name, func_name, varname)] = entry
+    return table
+
+
+def load_name_table(path, with_name_list=False, cache_path="", desc="Loading names"):
+    """
+    Stream a names jsonl file into a dict keyed by (prog_name, func_name,
+    varname). With `cache_path`, the parsed table is pickled there and reused
+    as long as the source file is unchanged.
+    """
+    start = time.time()
+    signature = _source_signature(path)
+    table = None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "rb") as fin:
+            cached_signature = pickle.load(fin)
+            if cached_signature == signature:
+                table = pickle.load(fin)
+    from_cache = table is not None
+    if table is None:
+        table = _read_table(path, with_name_list, desc)
+        if cache_path:
+            with open(cache_path, "wb") as fout:
+                pickle.dump(signature, fout, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(table, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    print(
+        "%s: %d entries from %s in %.2fs%s"
+        % (
+            desc,
+            len(table),
+            path,
+            time.time() - start,
+            " (cached)" if from_cache else "",
+        )
+    )
+    return table
@@ -0,0 +1,102 @@
+import os
+import pickle
+import time
+from tqdm import tqdm
+
+
+STORE_VERSION = 1
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return (STORE_VERSION, os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def _data_signature(path):
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+class ParsedIRStore:
+    """
+    The parsed lmpa_ir function records of a --parsed-in pickle, regrouped
+    into one pickle per program in a single data file. Only the index of
+    program offsets stays in memory; a program's records are read when it is
+    propagated. The store is rebuilt when --parsed-in changes, or when the
+    data file is not the one the index was written for.
+    """
+
+    def __init__(self, store_path, parsed_in):
+        self.data_path = store_path
+        self.index_path = store_path + ".index"
+        self.index = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as fin:
+                state = pickle.load(fin)
+            if state["signature"] == _source_signature(
+                parsed_in
+            ) and state.get("data_signature") == _data_signature(self.data_path):
+                self.index = state["index"]
+        if self.index is None:
+            self._build(parsed_in)
+        self.fin = open(self.data_path, "rb")
+
+    def _build(self, parsed_in):
+        start = time.time()
+        parsed_prog = pickle.load(open(parsed_in, "rb"))
+        prog_func_name2parsed = {}
+        for entry in tqdm(parsed_prog, desc="Indexing parsed prog"):
+            if entry["prog_name"] not in prog_func_name2parsed:
+                prog_func_name2parsed[entry["prog_name"]] = {}
+            prog_func_name2parsed[entry["prog_name"]][entry["func_name"]] = entry
+        del parsed_prog
+
+        index = {}
+        with open(self.data_path + ".tmp", "wb") as fout:
+            for prog_name in list(prog_func_name2parsed.keys()):
+                offset = fout.tell()
+                pickle.dump(
+                    prog_func_name2parsed.pop(prog_name),
+                    fout,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+                index[prog_name] = (offset, fout.tell() - offset)
+        os.replace(self.data_path + ".tmp", self.data_path)
+        with open(self.index_path + ".tmp", "wb") as fout:
+            pickle.dump(
+                {
+                    "signature": _source_signature(parsed_in),
+                    "data_signature": _data_signature(self.data_path),
+                    "index": index,
+                },
+                fout,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self.index = index
+        print(
+            "Parsed IR store: %d programs written to %s in %.2fs"
+            % (len(index), self.data_path, time.time() - start)
+        )
+
+    def __contains__(self, prog_name):
+        return prog_name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def load_prog(self, prog_name):
+        """
+        {func_name: parsed record} of one program
+        """
+        offset, length = self.index[prog_name]
+        self.fin.seek(offset)
+        return pickle.loads(self.fin.read(length))
+
+    def get(self, prog_name, func_name):
+        return self.load_prog(prog_name)[func_name]
+
+    def close(self):
+        self.fin.close()
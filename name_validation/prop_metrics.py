@@ -0,0 +1,121 @@
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+import torch
+
+
+class PropMetrics:
+    """
+    Timings and counters of one prop_names run, written as a JSON metrics
+    file and optionally as a Chrome trace (chrome://tracing, Perfetto)
+    """
+
+    def __init__(self, trace=False, top_k_progs=50):
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.counters = {}
+        self.prog_stats = []
+        self.batch_sizes = []
+        self.top_k_progs = top_k_progs
+        self.events = [] if trace else None
+
+    def span(self, name, begin, end=None, trace=True, **trace_args):
+        """
+        Account the perf_counter interval [begin, end] to `name`
+        """
+        if end is None:
+            end = time.perf_counter()
+        if name not in self.timings:
+            self.timings[name] = [0, 0.0]
+        self.timings[name][0] += 1
+        self.timings[name][1] += end - begin
+        if trace and self.events is not None:
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (begin - self.start) * 1e6,
+                    "dur": (end - begin) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": 0,
+                    "args": trace_args,
+                }
+            )
+
+    @contextmanager
+    def timer(self, name, trace=True, **trace_args):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span(name, begin, trace=trace, **trace_args)
+
+    def count(self, name, n=1):
+        if name not in self.counters:
+            self.counters[name] = 0
+        self.counters[name] += n
+
+    def record_prog(self, prog_name, seconds, num_funcs, num_records, num_entries):
+        self.prog_stats.append(
+            {
+                "prog_name": prog_name,
+                "seconds": seconds,
+                "num_funcs": num_funcs,
+                "num_records": num_records,
+                "num_entries": num_entries,
+            }
+        )
+
+    def record_batch(self, batch_size, padded_len):
+        self.batch_sizes.append((batch_size, padded_len))
+
+    def _resources(self):
+        wall = time.perf_counter() - self.start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        ret = {
+            "wall_seconds": wall,
+            "cpu_user_seconds": usage.ru_utime,
+            "cpu_sys_seconds": usage.ru_stime,
+            "cpu_utilization": (usage.ru_utime + usage.ru_stime) / max(wall, 1e-9),
+            "max_rss_mb": usage.ru_maxrss / 1024,
+        }
+        if torch.cuda.is_available():
+            ret["gpu_max_memory_allocated_mb"] = torch.cuda.max_memory_allocated() / 2**20
+            try:
+                ret["gpu_utilization"] = torch.cuda.utilization()
+            except Exception:
+                # needs pynvml
+                pass
+        return ret
+
+    def summary(self):
+        timings = {
+            name: {"calls": calls, "seconds": seconds}
+            for name, (calls, seconds) in self.timings.items()
+        }
+        slowest = sorted(self.prog_stats, key=lambda x: x["seconds"], reverse=True)
+        embedding = {"num_batches": len(self.batch_sizes)}
+        if len(self.batch_sizes) > 0:
+            sizes = [b for b, _ in self.batch_sizes]
+            padded = [l for _, l in self.batch_sizes]
+            embedding["mean_batch_size"] = sum(sizes) / len(sizes)
+            embedding["max_batch_size"] = max(sizes)
+            embedding["mean_padded_len"] = sum(padded) / len(padded)
+            embedding["max_padded_len"] = max(padded)
+        return {
+            "timings": timings,
+            "counters": self.counters,
+            "embedding": embedding,
+            "slowest_programs": slowest[: self.top_k_progs],
+            "resources": self._resources(),
+        }
+
+    def dump(self, metrics_path, trace_path=""):
+        if metrics_path:
+            with open(metrics_path, "w") as f:
+                json.dump(self.summary(), f, indent=2)
+        if trace_path and self.events is not None:
+            with open(trace_path, "w") as f:
+                json.dump({"traceEvents": self.events}, f)
@@ -1,17 +1,25 @@
-from transformers import (
-    AutoModel,
-    AutoTokenizer
-)
-import torch
 import json
 from tqdm import tqdm
 import argparse
-import logging
 import pickle
 import lmpa_ir
 import binary_prog
-from collections import namedtuple
+import numpy as np
+from name_embedding import (
+    CODEBERT_NAME,
+    NameEmbeddingService,
+    StaticNameEmbeddingService,
+    batched_vote,
+    load_codebert,
+    load_static_embeddings,
+)
+from name_loader import load_name_table
+from incremental import IncrementalCache
+from prop_metrics import PropMetrics
+from checkpoint import RunCheckpoint, file_signature
+from parsed_store import ParsedIRStore
 import copy
+import os
 import time
 
 
@@ -32,10 +40,95 @@ def parse_args():
         type=str,
         default="",
     )
+    args.add_argument(
+        "--parsed-store",
+        type=str,
+        default="",
+        help="indexed per-program store of --parsed-in, built on first use; programs are then loaded one at a time",
+    )
     args.add_argument("--names", type=str, default="")
+    args.add_argument(
+        "--names-cache",
+        type=str,
+        default="",
+        help="binary cache of the parsed --names table",
+    )
+    args.add_argument(
+        "--default-name-cache",
+        type=str,
+        default="",
+        help="binary cache of the parsed --default_name table",
+    )
     args.add_argument("--fout", type=str, default="")
     args.add_argument("--prop_round", type=int, default=1)
     args.add_argument("--upper_bound", action="store_true")
+    args.add_argument(
+        "--incremental-dir",
+        type=str,
+        default="",
+        help="per-program cache; only programs whose inputs changed are recomputed",
+    )
+    args.add_argument(
+        "--stream-batch-vars",
+        type=int,
+        default=20000,
+        help="vote and write once this many variables of finished programs are pending",
+    )
+    args.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="progress file updated after every write to --fout",
+    )
+    args.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue from --checkpoint, skipping completed programs",
+    )
+    args.add_argument(
+        "--metrics-out", type=str, default="", help="JSON file of timings and counters"
+    )
+    args.add_argument(
+        "--trace-out", type=str, default="", help="Chrome trace of stages and programs"
+    )
+    args.add_argument(
+        "--device",
+        type=str,
+        default="auto",
+        help="cuda, cpu, or auto (cuda when available)",
+    )
+    args.add_argument(
+        "--num-threads", type=int, default=0, help="torch threads on cpu, 0 for default"
+    )
+    args.add_argument(
+        "--quantize", action="store_true", help="dynamic int8 CodeBERT (cpu only)"
+    )
+    args.add_argument(
+        "--embedding-backend",
+        type=str,
+        default="codebert",
+        choices=["codebert", "static"],
+        help="CodeBERT forward pass, or mean of CodeBERT's input token embeddings",
+    )
+    args.add_argument(
+        "--static-emb-table",
+        type=str,
+        default="",
+        help=".npy cache of the token embedding table for --embedding-backend static, next to --emb-cache by default",
+    )
+    args.add_argument("--emb-batch-size", type=int, default=1024)
+    args.add_argument(
+        "--emb-cache",
+        type=str,
+        default="",
+        help="mmap'd embedding matrix file, reused across runs with the same model and --quantize",
+    )
+    args.add_argument(
+        "--emb-hot-rows",
+        type=int,
+        default=32768,
+        help="without --emb-cache, embeddings of the most recently used names kept across flushes",
+    )
     args = args.parse_args()
 
     return args
@@ -91,6 +184,7 @@ class PropagationRecorder:
         return True
 
     def receive_propagation_from(self, another, prop_reason=None):
+        num_added = 0
         for entry in another.propagation_list:
             if self.has_prop_entry(entry):
                 continue
@@ -100,7 +194,8 @@ class PropagationRecorder:
             other_entry_copied.prop_level += 1
             # if prop_reason is not None:
             #     other_entry_copied.prop_reason = prop_reason
-            self.add_propagation(other_entry_copied)
+            num_added += self.add_propagation(other_entry_copied)
+        return num_added
 
 
 # callee(arg1, arg2...)
@@ -109,9 +204,10 @@ def _from_callee_args(
     current_func_parsed,
     stripped_name2func,
     stripped_name2parsed,
-    names,
+    vote_stats,
     propagation_records,
 ):
+    num_added = 0
     all_exprs = _collect_all_exprs(current_func_parsed)
     all_call_exprs = [expr for expr in all_exprs if type(expr) == lmpa_ir.LmPaCallExpr]
     for call_expr in all_call_exprs:
@@ -142,7 +238,7 @@ def _from_callee_args(
                     var_name=callsite_arg.var_name,
                 )
             prop_fqn = (current_prog_name, callee_func_id, callee_params[i].var_name)
-            if should_propagate_from(prop_fqn, names):
+            if should_propagate_from(prop_fqn, vote_stats):
                 prop_entry = PropagationEntry(
                     prog_name=current_prog_name,
                     func_name=callee_func_id,
@@ -150,9 +246,10 @@ def _from_callee_args(
                     prop_level=0,
                     prop_reason="from callee args",
                 )
-                propagation_records[current_fully_qualified_name].add_propagation(
+                num_added += propagation_records[current_fully_qualified_name].add_propagation(
                     prop_entry
                 )
+    return num_added
 
 
 
@@ -162,9 +259,10 @@ def _from_callee_return(
     current_func_parsed,
     stripped_name2func,
     stripped_name2parsed,
-    names,
+    vote_stats,
     propagation_records,
 ):
+    num_added = 0
     all_exprs = _collect_all_exprs(current_func_parsed)
     interesting_exprs = []
     for expr in all_exprs:
@@ -208,7 +306,7 @@ def _from_callee_return(
             if type(ret_expr.ret_val) != lmpa_ir.LmPaVarExpression:
                 continue
             prop_fqn = (current_prog_name, callee_func_id, ret_expr.ret_val.var_name)
-            if should_propagate_from(prop_fqn, names):
+            if should_propagate_from(prop_fqn, vote_stats):
                 propagation_entry = PropagationEntry(
                     prog_name=current_prog_name,
                     func_name=callee_func_id,
@@ -216,25 +314,27 @@ def _from_callee_return(
                     prop_level=0,
                     prop_reason="from callee return",
                 )
-                propagation_records[current_fully_qualified_name].add_propagation(
+                num_added += propagation_records[current_fully_qualified_name].add_propagation(
                     propagation_entry
                 )
 
             if prop_fqn in propagation_records:
                 prop_source_recorder = propagation_records[prop_fqn]
-                propagation_records[
+                num_added += propagation_records[
                     current_fully_qualified_name
                 ].receive_propagation_from(
                     prop_source_recorder, prop_reason="from callee return"
                 )
+    return num_added
 
 
-def _from_caller_args(binary_prog, current_func_parsed, names, propagation_records):
+def _from_caller_args(binary_prog, current_func_parsed, vote_stats, propagation_records):
     if current_func_parsed['func_name'] not in binary_prog.call_graph:
-        return {}
+        return 0
     callers = list(binary_prog.call_graph.predecessors(current_func_parsed['func_name']))
     if len(callers) == 0:
-        return {}
+        return 0
+    num_added = 0
     my_func_id = current_func_parsed['func_name']
     for caller in callers:
         if caller not in binary_prog.stripped_name2parsed:
@@ -276,7 +376,7 @@ def _from_caller_args(binary_prog, current_func_parsed, names, propagation_recor
                     )
                 prop_fqn = (binary_prog.prog_name, caller, callsite_var_name)
 
-                if should_propagate_from(prop_fqn, names):
+                if should_propagate_from(prop_fqn, vote_stats):
                     prop_entry = PropagationEntry(
                         prog_name=binary_prog.prog_name,
                         func_name=caller,
@@ -284,25 +384,26 @@ def _from_caller_args(binary_prog, current_func_parsed, names, propagation_recor
                         prop_level=0,
                         prop_reason="from caller args",
                     )
-                    propagation_records[current_fully_qualified_name].add_propagation(
+                    num_added += propagation_records[current_fully_qualified_name].add_propagation(
                         prop_entry
                     )
                 if prop_fqn in propagation_records:
                     prop_source_recorder = propagation_records[prop_fqn]
-                    propagation_records[
+                    num_added += propagation_records[
                         current_fully_qualified_name
                     ].receive_propagation_from(
                         prop_source_recorder, prop_reason="from caller args"
                     )
+    return num_added
 
 
 # (in caller) var = my_func(...)
-def _from_caller_return(binary_prog, current_func_parsed, names, propagation_records):
+def _from_caller_return(binary_prog, current_func_parsed, vote_stats, propagation_records):
     if current_func_parsed['func_name'] not in binary_prog.call_graph:
-        return {}
+        return 0
     callers = list(binary_prog.call_graph.predecessors(current_func_parsed['func_name']))
     if len(callers) == 0:
-        return {}
+        return 0
     my_exprs = _collect_all_exprs(current_func_parsed)
     my_return_exprs = [
         expr for expr in my_exprs if type(expr) == lmpa_ir.LmPaReturnStmt
@@ -317,8 +418,9 @@ def _from_caller_return(binary_prog, current_func_parsed, names, propagation_rec
             interesting_my_return_vars.append(expr.ret_val)
             my_ret_var_set.add(ret_var_name)
     if len(interesting_my_return_vars) == 0:
-        return
+        return 0
 
+    num_added = 0
     my_func_id = current_func_parsed['func_name']
     for caller in callers:
         if caller not in binary_prog.stripped_name2parsed:
@@ -356,7 +458,7 @@ def _from_caller_return(binary_prog, current_func_parsed, names, propagation_rec
                         var_name=ret_var_name,
                     )
                 prop_fqn = (binary_prog.prog_name, caller, defined_var.var_name)
-                if should_propagate_from(prop_fqn, names):
+                if should_propagate_from(prop_fqn, vote_stats):
                     prop_entry = PropagationEntry(
                         prog_name=binary_prog.prog_name,
                         func_name=caller,
@@ -364,7 +466,8 @@ def _from_caller_return(binary_prog, current_func_parsed, names, propagation_rec
                         prop_level=0,
                         prop_reason="from caller return",
                     )
-                    propagation_records[current_fqn].add_propagation(prop_entry)
+                    num_added += propagation_records[current_fqn].add_propagation(prop_entry)
+    return num_added
 
 
 # var1 = var2
@@ -373,10 +476,11 @@ def _among_direct_use(
     current_func_parsed,
     stripped_name2func,
     stripped_name2parsed,
-    names,
+    vote_stats,
     propagation_records,
     prop_from_rhs=True,
 ):
+    num_added = 0
     all_exprs = _collect_all_exprs(current_func_parsed)
     interesting_exprs = []
     for expr in all_exprs:
@@ -407,7 +511,7 @@ def _among_direct_use(
                 func_name=current_func_parsed['func_name'],
                 var_name=defined_var_name,
             )
-        if should_propagate_from(prop_fqn, names):
+        if should_propagate_from(prop_fqn, vote_stats):
             prop_entry = PropagationEntry(
                 prog_name=current_prog_name,
                 func_name=current_func_parsed['func_name'],
@@ -415,183 +519,201 @@ def _among_direct_use(
                 prop_level=0,
                 prop_reason="from direct use",
             )
-            propagation_records[receive_fqn].add_propagation(prop_entry)
+            num_added += propagation_records[receive_fqn].add_propagation(prop_entry)
         if prop_fqn in propagation_records and prop_from_rhs:
             prop_source_recorder = propagation_records[prop_fqn]
-            propagation_records[receive_fqn].receive_propagation_from(
+            num_added += propagation_records[receive_fqn].receive_propagation_from(
                 prop_source_recorder, prop_reason="from direct use"
             )
+    return num_added
 
 
 CONFIDENT_THRESHOLD = 0
-def _filter_new_names(new_names):
+
+
+class NameVoteStats:
+    """
+    Majority predicted name of every (prog, func, var) in `names`, computed
+    once over the whole table. Row i holds the majority name id, its count,
+    the number of non-empty predictions and the majority ratio.
+    """
+
+    def __init__(self, names):
+        self.key2row = {}
+        self.vocab = []
+        name2id = {}
+        var_rows = []
+        name_ids = []
+        for row, (k, v) in enumerate(names.items()):
+            self.key2row[k] = row
+            for entry in v["name_list"]:
+                pred_name = entry["pred_name"]
+                if "<empty" in pred_name:
+                    continue
+                if pred_name not in name2id:
+                    name2id[pred_name] = len(self.vocab)
+                    self.vocab.append(pred_name)
+                var_rows.append(row)
+                name_ids.append(name2id[pred_name])
+        num_rows = len(self.key2row)
+        var_rows = np.array(var_rows, dtype=np.int64)
+        name_ids = np.array(name_ids, dtype=np.int64)
+
+        # count each (var, name) pair and remember where it first occurs, so
+        # that count ties go to the name predicted first
+        pair_keys = var_rows * max(len(self.vocab), 1) + name_ids
+        uniq_pairs, first_pos, pair_cnt = np.unique(
+            pair_keys, return_index=True, return_counts=True
+        )
+        pair_rows = var_rows[first_pos]
+        order = np.lexsort((first_pos, -pair_cnt, pair_rows))
+        is_head = np.ones(len(order), dtype=bool)
+        is_head[1:] = pair_rows[order][1:] != pair_rows[order][:-1]
+        heads = order[is_head]
+
+        self.total = np.bincount(var_rows, minlength=num_rows).astype(np.int32)
+        self.majority_name_id = np.full(num_rows, -1, dtype=np.int32)
+        self.majority_count = np.zeros(num_rows, dtype=np.int32)
+        self.majority_name_id[pair_rows[heads]] = name_ids[first_pos[heads]]
+        self.majority_count[pair_rows[heads]] = pair_cnt[heads]
+        self.ratio = np.zeros(num_rows, dtype=np.float32)
+        has_preds = self.total > 0
+        self.ratio[has_preds] = self.majority_count[has_preds] / self.total[has_preds]
+
+    def majority_name(self, key):
+        """
+        Majority name of `key` if it is confident enough, otherwise None
+        """
+        row = self.key2row.get(key)
+        if row is None or self.total[row] == 0:
+            return None
+        if self.majority_count[row] / self.total[row] > CONFIDENT_THRESHOLD:
+            return self.vocab[self.majority_name_id[row]]
+        return None
+
+
+def _filter_new_names(new_names, vote_stats):
     filtered_new_names = {}
     # rule out names where the propagation source does not agree
 
     for k, v in new_names.items():
         prog_name, func_name, varname = k
-        ori_preds, prop_preds = v["new_names"]
+        ori_preds, prop_sources = v["new_names"]
         if len(ori_preds) == 0:
             continue
         confident_props = []
-        for one_prop_source in prop_preds:
-            name_cnt = {}
-            cnt = 0
-            for entry in one_prop_source:
-                if "<empty" in entry["pred_name"]:
-                    continue
-                pred_name = entry["pred_name"]
-                if pred_name not in name_cnt:
-                    name_cnt[pred_name] = 0
-                name_cnt[pred_name] += 1
-                cnt += 1
-            total = cnt
-            if total == 0:
-                continue
-            sorted_name_cnt = sorted(name_cnt.items(), key=lambda x: x[1], reverse=True)
-            max_cnt = sorted_name_cnt[0][1]
-            if max_cnt / total > CONFIDENT_THRESHOLD:
-                confident_props.append(sorted_name_cnt[0][0])
+        for prop_fqn in prop_sources:
+            majority_name = vote_stats.majority_name(prop_fqn)
+            if majority_name is not None:
+                confident_props.append(majority_name)
         if len(confident_props) > 0:
             v["confident_new_names"] = confident_props
             filtered_new_names[k] = v
     return filtered_new_names
 
 
-propagation_source_record = {}
+def should_propagate_from(propagation_source, vote_stats):
+    return vote_stats.majority_name(propagation_source) is not None
 
 
-def should_propagate_from(propagation_source, names):
-    if propagation_source in propagation_source_record:
-        return propagation_source_record[propagation_source]
-    name_cnt = {}
-    if propagation_source not in names:
-        propagation_source_record[propagation_source] = False
-        return False
-    pred_names = names[propagation_source]["name_list"]
-    name_cnt = {}
-    cnt = 0
-    for entry in pred_names:
-        pred_name = entry["pred_name"]
-        if "<empty" in pred_name:
-            continue
-        if pred_name not in name_cnt:
-            name_cnt[pred_name] = 0
-        name_cnt[pred_name] += 1
-        cnt += 1
-    total = cnt
-    if total == 0:
-        propagation_source_record[propagation_source] = False
-        return False
-    
-
-    sorted_name_cnt = sorted(name_cnt.items(), key=lambda x: x[1], reverse=True)
-    max_cnt = sorted_name_cnt[0][1]
-    if max_cnt / total > CONFIDENT_THRESHOLD:
-        propagation_source_record[propagation_source] = True
-        return True
-    else:
-        propagation_source_record[propagation_source] = False
-        return False
+def _run_rule(metrics, rule_name, rule, *args, **kwargs):
+    """
+    Run one propagation rule; with `metrics`, time it and count the entries
+    it added
+    """
+    if metrics is None:
+        return rule(*args, **kwargs)
+    with metrics.timer("rule/" + rule_name, trace=False):
+        num_added = rule(*args, **kwargs)
+    metrics.count("rule_entries/" + rule_name, num_added)
+    return num_added
 
 
-def main():
-    args = parse_args()
-    codebert_tokenizer = AutoTokenizer.from_pretrained("microsoft/codebert-base")
-    codebert = AutoModel.from_pretrained("microsoft/codebert-base").eval().cuda()
-
-    default_names = {}
-    fin = open(args.default_name, "r").readlines()
-    for line in tqdm(fin, desc="Loading default names"):
-        entry = json.loads(line)
-        prog_name = entry["prog_name"]
-        func_name = entry["func_name"]
-        varname = entry["varname"]
-        default_names[(prog_name, func_name, varname)] = entry
-
-    names = {}
-    fin = open(args.names, "r").readlines()
-    for line in tqdm(fin, desc="Loading names"):
-        entry = json.loads(line)
-        name_list = eval(entry["name_list"])
-        entry["name_list"] = name_list
-        prog_name = entry["prog_name"]
-        func_name = entry["func_name"]
-        varname = entry["varname"]
-        names[(prog_name, func_name, varname)] = entry
-
-    data = pickle.load(open(args.ds_in, "rb"))
-    parsed_prog = pickle.load(open(args.parsed_in, "rb"))
-    prog_func_name2parsed = {}
-    for entry in tqdm(parsed_prog, desc="Loading parsed prog"):
-        if entry['prog_name'] not in prog_func_name2parsed:
-            prog_func_name2parsed[entry['prog_name']] = {}
-        prog_func_name2parsed[entry['prog_name']][entry['func_name']] = entry
-
-    time_before_prop = time.time()
-    new_names = {}
-    prop_stats = {}
+def propagate_prog(prog, stripped_name2parsed, vote_stats, prop_round, metrics=None):
+    """
+    Run all propagation rules over one program. Every rule stays within the
+    program, so the records of different programs are independent.
+    """
     propagation_records = {}
-    for prog in tqdm(data, desc="Propagating names"):
-        # propagate one prog
-        stripped_name2func = prog.stripped_name2func
-        stripped_name2parsed = prog_func_name2parsed[prog.prog_name]
-        # stripped_name2parsed = prog.stripped_name2parsed
-        func_name_list = list(stripped_name2func.keys())
-        current_prog_name = prog.prog_name
-        prog.stripped_name2parsed = stripped_name2parsed
-        for prop_rnd in range(args.prop_round):
-            for current_func_name in func_name_list:
-                if current_func_name not in stripped_name2parsed:
-                    continue
-                current_func_parsed = stripped_name2parsed[current_func_name]
-
-                _from_callee_args(
-                    current_prog_name,
-                    current_func_parsed,
-                    stripped_name2func,
-                    stripped_name2parsed,
-                    names,
-                    propagation_records,
-                )
-                _from_callee_return(
-                    current_prog_name,
-                    current_func_parsed,
-                    stripped_name2func,
-                    stripped_name2parsed,
-                    names,
-                    propagation_records,
-                )
-                _from_caller_args(prog, current_func_parsed, names, propagation_records)
-                _from_caller_return(
-                    prog, current_func_parsed, names, propagation_records
-                )
-                _among_direct_use(
-                    current_prog_name,
-                    current_func_parsed,
-                    stripped_name2func,
-                    stripped_name2parsed,
-                    names,
-                    propagation_records,
-                    prop_from_rhs=True,
-                )
-                _among_direct_use(
-                    current_prog_name,
-                    current_func_parsed,
-                    stripped_name2func,
-                    stripped_name2parsed,
-                    names,
-                    propagation_records,
-                    prop_from_rhs=False,
-                )
+    stripped_name2func = prog.stripped_name2func
+    func_name_list = list(stripped_name2func.keys())
+    current_prog_name = prog.prog_name
+    prog.stripped_name2parsed = stripped_name2parsed
+    for prop_rnd in range(prop_round):
+        for current_func_name in func_name_list:
+            if current_func_name not in stripped_name2parsed:
+                continue
+            current_func_parsed = stripped_name2parsed[current_func_name]
 
-    for k, v in propagation_records.items():
-        for entry in v.propagation_list:
-            if entry.prop_reason not in prop_stats:
-                prop_stats[entry.prop_reason] = 0
-            prop_stats[entry.prop_reason] += 1
+            _run_rule(
+                metrics,
+                "_from_callee_args",
+                _from_callee_args,
+                current_prog_name,
+                current_func_parsed,
+                stripped_name2func,
+                stripped_name2parsed,
+                vote_stats,
+                propagation_records,
+            )
+            _run_rule(
+                metrics,
+                "_from_callee_return",
+                _from_callee_return,
+                current_prog_name,
+                current_func_parsed,
+                stripped_name2func,
+                stripped_name2parsed,
+                vote_stats,
+                propagation_records,
+            )
+            _run_rule(
+                metrics,
+                "_from_caller_args",
+                _from_caller_args,
+                prog,
+                current_func_parsed,
+                vote_stats,
+                propagation_records,
+            )
+            _run_rule(
+                metrics,
+                "_from_caller_return",
+                _from_caller_return,
+                prog,
+                current_func_parsed,
+                vote_stats,
+                propagation_records,
+            )
+            _run_rule(
+                metrics,
+                "_among_direct_use(rhs)",
+                _among_direct_use,
+                current_prog_name,
+                current_func_parsed,
+                stripped_name2func,
+                stripped_name2parsed,
+                vote_stats,
+                propagation_records,
+                prop_from_rhs=True,
+            )
+            _run_rule(
+                metrics,
+                "_among_direct_use(lhs)",
+                _among_direct_use,
+                current_prog_name,
+                current_func_parsed,
+                stripped_name2func,
+                stripped_name2parsed,
+                vote_stats,
+                propagation_records,
+                prop_from_rhs=False,
+            )
+    return propagation_records
 
-    ret = {}
+
+def collect_new_names(propagation_records, names):
+    new_names = {}
     for ori, prop_record in propagation_records.items():
         names_to_propagate = []
         ori_key = ori
@@ -607,25 +729,36 @@ def main():
             )
             if prop_fqn not in names:
                 continue
-            prop_preds = names[prop_fqn]["name_list"]
-            names_to_propagate.append(prop_preds)
+            names_to_propagate.append(prop_fqn)
 
         if len(names_to_propagate) > 0:
-            ret[ori] = (ori_preds, names_to_propagate)
-    for k, v in ret.items():
-        new_names[k] = {
-            "varname": k[2],
-            "new_names": v,
-        }
-
-    print("Before filtering, propagation stats: " + str(prop_stats))
-    filtered_new_names = _filter_new_names(new_names)
-    print("After filtering, remaining new names: " + str(len(filtered_new_names)))
-    time_before_name_selection = time.time()
+            new_names[ori] = {
+                "varname": ori[2],
+                "new_names": (ori_preds, names_to_propagate),
+            }
+    return new_names
+
+
+def _pack_ragged(index_lists):
+    offsets = np.zeros(len(index_lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(l) for l in index_lists])
+    if len(index_lists) == 0:
+        return np.zeros(0, dtype=np.int64), offsets
+    return np.concatenate(index_lists), offsets
+
+
+def select_names(keys, names, default_names, filtered_new_names, embedder, upper_bound):
+    """
+    Pick one name for every variable in `keys`. Returns the selections in
+    `keys` order and how many variables fell back to a default name because
+    they had no candidate.
+    """
     new_name_selections = {}
     default_not_in = 0
-    for k, v in tqdm(names.items(), desc="Selecting new names"):
-        if args.upper_bound:
+    voting_tasks = []
+    for k in keys:
+        v = names[k]
+        if upper_bound:
             sorted_name_list = sorted(
                 v["name_list"], key=lambda x: x["precision"], reverse=True
             )
@@ -649,18 +782,10 @@ def main():
                 # selected = v["name_list"][0]
                 new_name_selections[k] = selected
             continue
-        # name_tokens = [
-        #     torch.tensor(tokenizer.encode(name)).cuda() for name in name_candidates
-        # ]
         if len(set(name_candidates)) == 1:
             selected = name2name_list_entry[name_candidates[0]]
             new_name_selections[k] = selected
             continue
-        tokenized_names = codebert_tokenizer(name_candidates, return_tensors="pt", padding=True, truncation=True)
-        tokenized_names = {k: v.cuda() for k, v in tokenized_names.items()}
-        with torch.no_grad():
-            name_embs = codebert(**tokenized_names).last_hidden_state[:, 0, :]            
-            name_embs_tensor = name_embs
 
         if k not in filtered_new_names:
             if k in default_names:
@@ -672,46 +797,407 @@ def main():
         prop_names = filtered_new_names[k]["confident_new_names"]
         names_for_voting = prop_names + name_candidates_list
         # names_for_voting = prop_names
-        prop_name_tokenized = codebert_tokenizer(names_for_voting, return_tensors="pt", padding=True, truncation=True)
-        prop_name_tokens = {k: v.cuda() for k, v in prop_name_tokenized.items()}
-        with torch.no_grad():
-            prop_name_embs = codebert(**prop_name_tokens).last_hidden_state[:, 0, :]
-            prop_name_embs_tensor = prop_name_embs
-            name_embs_tensor = name_embs_tensor / name_embs_tensor.norm(
-                dim=-1, keepdim=True
-            )
-            prop_name_embs_tensor = prop_name_embs_tensor / prop_name_embs_tensor.norm(
-                dim=-1, keepdim=True
-            )
-            similarity = torch.matmul(
-                name_embs_tensor, prop_name_embs_tensor.transpose(0, 1)
+        embedder.add_names(name_candidates)
+        embedder.add_names(names_for_voting)
+        # keep the output order, filled in after voting
+        new_name_selections[k] = None
+        voting_tasks.append((k, name_candidates, names_for_voting, name2name_list_entry))
+
+    if len(voting_tasks) == 0:
+        return new_name_selections, default_not_in
+    embedder.embed_all()
+    cand_idx, cand_offsets = _pack_ragged(
+        [embedder.index(task[1]) for task in voting_tasks]
+    )
+    voter_idx, voter_offsets = _pack_ragged(
+        [embedder.index(task[2]) for task in voting_tasks]
+    )
+    selections = batched_vote(
+        embedder.matrix, cand_idx, cand_offsets, voter_idx, voter_offsets
+    )
+    for (k, name_candidates, _, name2name_list_entry), sel in zip(
+        voting_tasks, selections
+    ):
+        new_name_selections[k] = name2name_list_entry[name_candidates[sel]]
+    return new_name_selections, default_not_in
+
+
+def _update_prop_stats(prop_stats, propagation_records):
+    for k, v in propagation_records.items():
+        for entry in v.propagation_list:
+            if entry.prop_reason not in prop_stats:
+                prop_stats[entry.prop_reason] = 0
+            prop_stats[entry.prop_reason] += 1
+
+
+def _write_selection(f, k, v):
+    prog_name, func_name, varname = k
+    f.write(
+        json.dumps(
+            {
+                "prog_name": prog_name,
+                "func_name": func_name,
+                "varname": varname,
+                **v,
+            }
+        )
+        + "\n"
+    )
+
+
+class StreamingSelector:
+    """
+    Buffer programs whose propagation is done until about `batch_vars`
+    variables are pending, then vote for all of them at once and append
+    their selections to `f` in program order. Memory is bounded by one
+    buffer instead of the whole corpus, and the output written so far
+    survives a crash; with a `checkpoint`, every flush is recorded so that
+    a resumed run can skip the completed programs.
+    """
+
+    STAT_FIELDS = [
+        "prop_stats",
+        "prop_seconds",
+        "num_filtered",
+        "num_selected",
+        "default_not_in",
+        "seconds",
+    ]
+
+    def __init__(
+        self,
+        f,
+        names,
+        default_names,
+        vote_stats,
+        embedder,
+        upper_bound,
+        batch_vars,
+        cache=None,
+        metrics=None,
+        checkpoint=None,
+        resume_state=None,
+    ):
+        self.f = f
+        self.names = names
+        self.default_names = default_names
+        self.vote_stats = vote_stats
+        self.embedder = embedder
+        self.upper_bound = upper_bound
+        self.batch_vars = batch_vars
+        self.cache = cache
+        self.metrics = metrics
+        self.checkpoint = checkpoint
+        # (prog_name, keys, propagation records, fingerprint, cached selections)
+        self.pending = []
+        self.num_pending_vars = 0
+        self.prop_stats = {}
+        self.prop_seconds = 0
+        self.num_filtered = 0
+        self.num_selected = 0
+        self.default_not_in = 0
+        self.seconds = 0
+        if resume_state is not None:
+            for field in StreamingSelector.STAT_FIELDS:
+                setattr(self, field, resume_state["stats"][field])
+
+    def add(self, prog_name, prog_keys, prog_records, fingerprint=None, prop_seconds=0):
+        _update_prop_stats(self.prop_stats, prog_records)
+        self.prop_seconds += prop_seconds
+        self.pending.append((prog_name, prog_keys, prog_records, fingerprint, None))
+        self.num_pending_vars += len(prog_keys)
+        if self.num_pending_vars >= self.batch_vars:
+            self.flush()
+
+    def add_cached(self, prog_name, prog_keys, prog_records, selections):
+        _update_prop_stats(self.prop_stats, prog_records)
+        self.pending.append((prog_name, prog_keys, None, None, selections))
+        self.num_pending_vars += len(prog_keys)
+        if self.num_pending_vars >= self.batch_vars:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        begin = time.perf_counter()
+        new_names = {}
+        keys_to_select = []
+        for _, prog_keys, prog_records, _, cached in self.pending:
+            if cached is not None:
+                continue
+            new_names.update(collect_new_names(prog_records, self.names))
+            keys_to_select.extend(prog_keys)
+        filtered_new_names = _filter_new_names(new_names, self.vote_stats)
+        self.num_filtered += len(filtered_new_names)
+        selections, default_not_in = select_names(
+            keys_to_select,
+            self.names,
+            self.default_names,
+            filtered_new_names,
+            self.embedder,
+            self.upper_bound,
+        )
+        self.embedder.release()
+        self.default_not_in += default_not_in
+
+        flushed_progs = []
+        for prog_name, prog_keys, prog_records, fingerprint, cached in self.pending:
+            prog_selections = selections if cached is None else cached
+            stored = {}
+            for k in prog_keys:
+                if k in prog_selections:
+                    stored[k] = prog_selections[k]
+                    _write_selection(self.f, k, prog_selections[k])
+            self.num_selected += len(stored)
+            if self.cache is not None and cached is None:
+                self.cache.store(prog_name, fingerprint, prog_records, stored)
+            flushed_progs.append(prog_name)
+        self.f.flush()
+        self.pending = []
+        self.num_pending_vars = 0
+        end = time.perf_counter()
+        self.seconds += end - begin
+        if self.metrics is not None:
+            self.metrics.span("selection_batch", begin, end, num_vars=len(keys_to_select))
+        if self.checkpoint is not None:
+            os.fsync(self.f.fileno())
+            self.checkpoint.save(
+                flushed_progs,
+                self.f.tell(),
+                {field: getattr(self, field) for field in StreamingSelector.STAT_FIELDS},
             )
-            scores = torch.mean(similarity, dim=-1)
-            sorted_scores = torch.argsort(scores, descending=True)
-            selected = name2name_list_entry[name_candidates[sorted_scores[0]]]
-            new_name_selections[k] = selected
 
-    print("Default not in: " + str(default_not_in))
-    with open(args.fout, "w") as f:
-        for k, v in new_name_selections.items():
-            prog_name, func_name, varname = k
-            f.write(
-                json.dumps(
-                    {
-                        "prog_name": prog_name,
-                        "func_name": func_name,
-                        "varname": varname,
-                        **v,
-                    }
+
+def _run_config(args):
+    """
+    The arguments that decide the selections, shared by the incremental
+    cache and the checkpoint signature
+    """
+    config = {
+        "prop_round": args.prop_round,
+        "upper_bound": args.upper_bound,
+        "embedding_backend": args.embedding_backend,
+    }
+    if args.embedding_backend == "codebert":
+        config["quantize"] = args.quantize
+    return config
+
+
+def main():
+    args = parse_args()
+    if args.resume and not (args.checkpoint and os.path.exists(args.checkpoint)):
+        # without a checkpoint the run would start over and truncate --fout
+        raise ValueError("--resume needs an existing --checkpoint, got '%s'" % args.checkpoint)
+    if args.embedding_backend == "static":
+        if args.quantize or args.device != "auto":
+            raise ValueError("--quantize and --device only apply to --embedding-backend codebert")
+        if not args.static_emb_table:
+            if not args.emb_cache:
+                # the table would be extracted from CodeBERT on every run
+                raise ValueError("--embedding-backend static needs --static-emb-table or --emb-cache")
+            args.static_emb_table = args.emb_cache + ".static_table.npy"
+    metrics = None
+    if args.metrics_out or args.trace_out:
+        metrics = PropMetrics(trace=bool(args.trace_out))
+    stage_begin = time.perf_counter()
+    if args.embedding_backend == "static":
+        codebert_tokenizer, static_table = load_static_embeddings(args.static_emb_table)
+    else:
+        codebert_tokenizer, codebert = load_codebert(
+            args.device, num_threads=args.num_threads, quantize=args.quantize
+        )
+
+    default_names = load_name_table(
+        args.default_name,
+        cache_path=args.default_name_cache,
+        desc="Loading default names",
+    )
+    names = load_name_table(
+        args.names,
+        with_name_list=True,
+        cache_path=args.names_cache,
+        desc="Loading names",
+    )
+
+    data = pickle.load(open(args.ds_in, "rb"))
+    parsed_store = None
+    prog_func_name2parsed = None
+    if args.parsed_store:
+        parsed_store = ParsedIRStore(args.parsed_store, args.parsed_in)
+    else:
+        parsed_prog = pickle.load(open(args.parsed_in, "rb"))
+        prog_func_name2parsed = {}
+        for entry in tqdm(parsed_prog, desc="Loading parsed prog"):
+            if entry['prog_name'] not in prog_func_name2parsed:
+                prog_func_name2parsed[entry['prog_name']] = {}
+            prog_func_name2parsed[entry['prog_name']][entry['func_name']] = entry
+
+    prog_name2keys = {}
+    for k in names.keys():
+        if k[0] not in prog_name2keys:
+            prog_name2keys[k[0]] = []
+        prog_name2keys[k[0]].append(k)
+    if metrics is not None:
+        metrics.span("stage/load", stage_begin)
+
+    cache = None
+    if args.incremental_dir:
+        cache = IncrementalCache(
+            args.incremental_dir,
+            _run_config(args),
+        )
+
+    vote_stats_begin = time.perf_counter()
+    vote_stats = NameVoteStats(names)
+    if metrics is not None:
+        metrics.span("stage/vote_stats", vote_stats_begin)
+    if args.embedding_backend == "static":
+        # the two backends embed into different spaces, keep their caches apart
+        embedder = StaticNameEmbeddingService(
+            codebert_tokenizer,
+            static_table,
+            batch_size=args.emb_batch_size,
+            emb_file=(args.emb_cache + ".static") if args.emb_cache else None,
+            metrics=metrics,
+            cache_config={"model": CODEBERT_NAME, "embedding_backend": "static"},
+            max_rows=args.emb_hot_rows,
+        )
+    else:
+        embedder = NameEmbeddingService(
+            codebert_tokenizer,
+            codebert,
+            batch_size=args.emb_batch_size,
+            emb_file=args.emb_cache or None,
+            metrics=metrics,
+            cache_config={"model": CODEBERT_NAME, "quantize": args.quantize},
+            max_rows=args.emb_hot_rows,
+        )
+    checkpoint = None
+    resume_state = None
+    if args.checkpoint:
+        checkpoint = RunCheckpoint(
+            args.checkpoint,
+            {
+                "names": file_signature(args.names),
+                "default_name": file_signature(args.default_name),
+                "ds_in": file_signature(args.ds_in),
+                "parsed_in": file_signature(args.parsed_in),
+                **_run_config(args),
+            },
+        )
+        if args.resume:
+            resume_state = checkpoint.load()
+        else:
+            checkpoint.reset()
+    completed_progs = set()
+    if resume_state is not None:
+        completed_progs = set(resume_state["completed_progs"])
+        # drop anything written after the last checkpoint
+        os.truncate(args.fout, resume_state["fout_offset"])
+        print(
+            "Resuming: %d programs already completed" % len(completed_progs)
+        )
+    seen_prog_names = set()
+    with open(args.fout, "w" if resume_state is None else "a") as f:
+        selector = StreamingSelector(
+            f,
+            names,
+            default_names,
+            vote_stats,
+            embedder,
+            args.upper_bound,
+            args.stream_batch_vars,
+            cache=cache,
+            metrics=metrics,
+            checkpoint=checkpoint,
+            resume_state=resume_state,
+        )
+        for prog in tqdm(data, desc="Propagating and selecting names"):
+            if prog.prog_name in seen_prog_names:
+                continue
+            if prog.prog_name in completed_progs:
+                seen_prog_names.add(prog.prog_name)
+                continue
+            # propagate one prog
+            if parsed_store is not None:
+                stripped_name2parsed = parsed_store.load_prog(prog.prog_name)
+            else:
+                stripped_name2parsed = prog_func_name2parsed[prog.prog_name]
+            seen_prog_names.add(prog.prog_name)
+            prog_keys = prog_name2keys.get(prog.prog_name, [])
+            fingerprint = None
+            if cache is not None:
+                fingerprint = cache.fingerprint(
+                    prog, stripped_name2parsed, prog_keys, names, default_names
+                )
+                cached = cache.load(prog.prog_name, fingerprint)
+                if cached is not None:
+                    selector.add_cached(
+                        prog.prog_name,
+                        prog_keys,
+                        cached["propagation_records"],
+                        cached["selections"],
+                    )
+                    continue
+            prog_begin = time.perf_counter()
+            prog_records = propagate_prog(
+                prog, stripped_name2parsed, vote_stats, args.prop_round, metrics=metrics
+            )
+            prog_end = time.perf_counter()
+            # the records only refer to names, the IR is not needed anymore
+            prog.stripped_name2parsed = None
+            if metrics is not None:
+                metrics.span("prog", prog_begin, prog_end, prog_name=prog.prog_name)
+                metrics.record_prog(
+                    prog.prog_name,
+                    prog_end - prog_begin,
+                    len(prog.stripped_name2func),
+                    len(prog_records),
+                    sum(len(r.propagation_list) for r in prog_records.values()),
                 )
-                + "\n"
+            selector.add(
+                prog.prog_name,
+                prog_keys,
+                prog_records,
+                fingerprint,
+                prop_seconds=prog_end - prog_begin,
             )
+
+        # variables of programs that are not in --ds-in get no propagation
+        for prog_name, prog_keys in prog_name2keys.items():
+            if prog_name in seen_prog_names or prog_name in completed_progs:
+                continue
+            fingerprint = None
+            if cache is not None:
+                fingerprint = cache.fingerprint(None, {}, prog_keys, names, default_names)
+                cached = cache.load(prog_name, fingerprint)
+                if cached is not None:
+                    selector.add_cached(prog_name, prog_keys, {}, cached["selections"])
+                    continue
+            selector.add(prog_name, prog_keys, {}, fingerprint)
+        selector.flush()
+    if parsed_store is not None:
+        parsed_store.close()
+
+    print("Before filtering, propagation stats: " + str(selector.prop_stats))
+    print("After filtering, remaining new names: " + str(selector.num_filtered))
+    if cache is not None:
+        print(
+            "Incremental cache: %d programs reused, %d recomputed"
+            % (cache.hits, cache.misses)
+        )
+    print("Default not in: " + str(selector.default_not_in))
     print()
-    final_time = time.time()
-    print("Propagation time: " + str(time_before_name_selection - time_before_prop))
-    print("Name selection time: " + str(final_time - time_before_name_selection))
+    print("Propagation time: " + str(selector.prop_seconds))
+    print("Name selection time: " + str(selector.seconds))
+    if metrics is not None:
+        if cache is not None:
+            metrics.count("incremental_cache/hits", cache.hits)
+            metrics.count("incremental_cache/misses", cache.misses)
+        metrics.count("selection/selected", selector.num_selected)
+        metrics.count("selection/default_not_in", selector.default_not_in)
+        metrics.dump(args.metrics_out, args.trace_out)
 
 
 if __name__ == "__main__":
     main()
-
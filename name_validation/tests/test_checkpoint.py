@@ -0,0 +1,35 @@
+import os
+import pickle
+from checkpoint import RunCheckpoint
+
+
+STATS = {"num_selected": 0}
+
+
+def test_save_appends_only_the_new_programs(tmp_path):
+    path = str(tmp_path / "ckpt")
+    checkpoint = RunCheckpoint(path, ("run", 1))
+    checkpoint.reset()
+    checkpoint.save(["prog_0", "prog_1"], 10, STATS)
+    state_size = os.path.getsize(path)
+    checkpoint.save(["prog_%d" % i for i in range(2, 102)], 20, STATS)
+    # only the recorded offsets grow, by a few bytes
+    assert os.path.getsize(path) < state_size + 16
+    state = RunCheckpoint(path, ("run", 1)).load()
+    assert state["completed_progs"] == ["prog_%d" % i for i in range(102)]
+    assert state["fout_offset"] == 20
+
+
+def test_programs_logged_after_the_last_state_are_dropped(tmp_path):
+    path = str(tmp_path / "ckpt")
+    checkpoint = RunCheckpoint(path, ("run", 1))
+    checkpoint.reset()
+    checkpoint.save(["prog_0"], 10, STATS)
+    state = pickle.load(open(path, "rb"))
+    # killed between the log append and the state replace
+    checkpoint.save(["prog_1"], 20, STATS)
+    pickle.dump(state, open(path, "wb"))
+    resumed = RunCheckpoint(path, ("run", 1))
+    assert resumed.load()["completed_progs"] == ["prog_0"]
+    resumed.save(["prog_2"], 30, STATS)
+    assert resumed.load()["completed_progs"] == ["prog_0", "prog_2"]
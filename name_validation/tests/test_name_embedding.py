@@ -0,0 +1,103 @@
+import os
+import tracemalloc
+import numpy as np
+import pytest
+from name_embedding import StaticNameEmbeddingService
+from prop_metrics import PropMetrics
+from conftest import CharTokenizer
+
+
+HIDDEN_SIZE = 16
+
+
+def new_service(emb_file=None, **kwargs):
+    table = np.random.RandomState(0).rand(64, HIDDEN_SIZE).astype(np.float32)
+    return StaticNameEmbeddingService(CharTokenizer(), table, emb_file=emb_file, **kwargs)
+
+
+def embed(service, names):
+    service.add_names(names)
+    service.embed_all()
+    return np.asarray(service.matrix[service.index(names)])
+
+
+def test_emb_file_is_append_only(tmp_path):
+    emb_file = str(tmp_path / "emb")
+    service = new_service(emb_file)
+    first = embed(service, ["buf", "len"])
+    size = os.path.getsize(emb_file)
+    second = embed(service, ["len", "count", "idx"])
+    assert os.path.getsize(emb_file) == size + 2 * 4 * HIDDEN_SIZE
+    assert service.names == ["buf", "len", "count", "idx"]
+
+    reloaded = new_service(emb_file)
+    assert reloaded.names == service.names
+    np.testing.assert_array_equal(embed(reloaded, ["buf", "len"]), first)
+    np.testing.assert_array_equal(embed(reloaded, ["len", "count", "idx"]), second)
+    assert os.path.getsize(emb_file) == size + 2 * 4 * HIDDEN_SIZE
+
+
+def test_interrupted_append_is_trimmed(tmp_path):
+    emb_file = str(tmp_path / "emb")
+    service = new_service(emb_file)
+    embed(service, ["buf", "len"])
+    with open(emb_file, "ab") as fout:
+        fout.write(np.ones(HIDDEN_SIZE, dtype=np.float32).tobytes())
+    with open(emb_file + ".names.jsonl", "a") as fout:
+        fout.write('"cou')
+
+    reloaded = new_service(emb_file)
+    assert reloaded.names == ["buf", "len"]
+    embed(reloaded, ["count"])
+    assert new_service(emb_file).names == ["buf", "len", "count"]
+
+
+def test_resident_size_is_flat_over_flushes():
+    service = new_service(max_rows=2000)
+    tracemalloc.start()
+    sizes = []
+    for flush in range(20):
+        embed(service, ["name_%d_%d" % (flush, i) for i in range(2000)])
+        service.release()
+        sizes.append(tracemalloc.get_traced_memory()[0])
+    tracemalloc.stop()
+    # one flush of 2000 names holds ~128KB of rows alone
+    assert max(sizes[1:]) - sizes[1] < 64 * 1024
+
+
+def test_release_keeps_the_recently_used_rows():
+    metrics = PropMetrics()
+    service = new_service(max_rows=2, metrics=metrics)
+    first = embed(service, ["buf", "len"])
+    service.release()
+    embed(service, ["len", "count"])
+    service.release()
+    assert service.names == ["len", "count"]
+    again = embed(service, ["buf", "len"])
+    assert np.allclose(again, first)
+    assert metrics.counters["embedding/names_embedded"] == 4
+    assert metrics.counters["embedding/reembedded"] == 1
+    assert metrics.counters["embedding/evicted"] == 1
+
+
+def test_emb_file_is_refused_under_another_config(tmp_path):
+    emb_file = str(tmp_path / "emb")
+    table = np.random.RandomState(0).rand(64, HIDDEN_SIZE).astype(np.float32)
+    config = {"model": "microsoft/codebert-base", "quantize": False}
+    service = StaticNameEmbeddingService(
+        CharTokenizer(), table, emb_file=emb_file, cache_config=config
+    )
+    embed(service, ["buf", "len"])
+    reopened = StaticNameEmbeddingService(
+        CharTokenizer(), table, emb_file=emb_file, cache_config=dict(config)
+    )
+    assert reopened.names == ["buf", "len"]
+    with pytest.raises(ValueError):
+        StaticNameEmbeddingService(
+            CharTokenizer(), table, emb_file=emb_file, cache_config=dict(config, quantize=True)
+        )
+    os.remove(emb_file + ".config.json")
+    with pytest.raises(ValueError):
+        StaticNameEmbeddingService(
+            CharTokenizer(), table, emb_file=emb_file, cache_config=config
+        )
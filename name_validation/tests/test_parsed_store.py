@@ -0,0 +1,44 @@
+import os
+import pickle
+from parsed_store import ParsedIRStore
+
+
+def build(tmp_path):
+    parsed = [
+        {"prog_name": "prog_%d" % (i % 3), "func_name": "sub_%x" % i, "i": i}
+        for i in range(9)
+    ]
+    parsed_in = str(tmp_path / "parsed.pkl")
+    pickle.dump(parsed, open(parsed_in, "wb"))
+    return str(tmp_path / "store"), parsed_in
+
+
+def test_store_is_reused(tmp_path, capsys):
+    store_path, parsed_in = build(tmp_path)
+    store = ParsedIRStore(store_path, parsed_in)
+    assert sorted(store.load_prog("prog_1")) == ["sub_1", "sub_4", "sub_7"]
+    store.close()
+    capsys.readouterr()
+    store = ParsedIRStore(store_path, parsed_in)
+    assert "written" not in capsys.readouterr().out
+    assert store.get("prog_2", "sub_5")["i"] == 5
+    store.close()
+
+
+def test_store_is_rebuilt_when_data_file_changes(tmp_path, capsys):
+    store_path, parsed_in = build(tmp_path)
+    ParsedIRStore(store_path, parsed_in).close()
+
+    os.remove(store_path)
+    capsys.readouterr()
+    store = ParsedIRStore(store_path, parsed_in)
+    assert "written" in capsys.readouterr().out
+    assert store.get("prog_0", "sub_3")["i"] == 3
+    store.close()
+
+    with open(store_path, "ab") as fout:
+        fout.write(b"replaced")
+    store = ParsedIRStore(store_path, parsed_in)
+    assert "written" in capsys.readouterr().out
+    assert store.get("prog_0", "sub_6")["i"] == 6
+    store.close()
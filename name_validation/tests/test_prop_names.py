@@ -0,0 +1,195 @@
+import json
+import os
+import pickle
+import random
+import sys
+import numpy as np
+import pytest
+
+pytest.importorskip("lmpa_ir")
+pytest.importorskip("binary_prog")
+import bench_prop_names
+import checkpoint
+import prop_names
+from conftest import CharTokenizer
+
+
+VOCAB = ["name_%d" % i for i in range(12)]
+
+
+STATIC_TABLE_PATHS = []
+
+
+def load_static_embeddings(cache_path=""):
+    STATIC_TABLE_PATHS.append(cache_path)
+    return CharTokenizer(), np.random.RandomState(0).rand(64, 16).astype(np.float32)
+
+
+class Killed(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def static_backend(monkeypatch):
+    monkeypatch.setattr(prop_names, "load_static_embeddings", load_static_embeddings)
+    if not hasattr(prop_names, "_collect_all_exprs"):
+        monkeypatch.setattr(
+            prop_names,
+            "_collect_all_exprs",
+            lambda parsed: parsed["lmpa_exprs"],
+            raising=False,
+        )
+
+
+def write_jsonl(path, entries):
+    with open(path, "w") as fout:
+        for entry in entries:
+            fout.write(json.dumps(entry) + "\n")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    rng = random.Random(7)
+    progs = []
+    parsed = []
+    names = []
+    default_names = []
+    for p in range(6):
+        prog, stripped_name2parsed = bench_prop_names.gen_program(
+            "prog_%d" % p, 20, 3, 3, 8, rng
+        )
+        progs.append(prog)
+        parsed.extend(stripped_name2parsed.values())
+        for entry in bench_prop_names.gen_names(prog, VOCAB, 5, rng).values():
+            names.append(entry)
+            default_names.append(
+                {
+                    "prog_name": entry["prog_name"],
+                    "func_name": entry["func_name"],
+                    "varname": entry["varname"],
+                    "pred_name": "default",
+                    "precision": 0.0,
+                }
+            )
+    paths = {
+        "ds_in": str(tmp_path / "ds.pkl"),
+        "parsed_in": str(tmp_path / "parsed.pkl"),
+        "names": str(tmp_path / "names.jsonl"),
+        "default_name": str(tmp_path / "default.jsonl"),
+        "static_emb_table": str(tmp_path / "table.npy"),
+    }
+    pickle.dump(progs, open(paths["ds_in"], "wb"))
+    pickle.dump(parsed, open(paths["parsed_in"], "wb"))
+    write_jsonl(paths["names"], names)
+    write_jsonl(paths["default_name"], default_names)
+    return paths
+
+
+def run(monkeypatch, corpus, fout, *extra, static_emb_table=True):
+    argv = [
+        "prop_names.py",
+        "--ds-in", corpus["ds_in"],
+        "--parsed-in", corpus["parsed_in"],
+        "--names", corpus["names"],
+        "--default_name", corpus["default_name"],
+        "--fout", fout,
+        "--embedding-backend", "static",
+        "--stream-batch-vars", "200",
+    ] + list(extra)
+    if static_emb_table:
+        argv += ["--static-emb-table", corpus["static_emb_table"]]
+    monkeypatch.setattr(sys, "argv", argv)
+    prop_names.main()
+    return open(fout, "rb").read()
+
+
+def test_killed_run_resumes_to_identical_output(monkeypatch, corpus, tmp_path):
+    expected = run(monkeypatch, corpus, str(tmp_path / "full.jsonl"))
+    assert len(expected.splitlines()) > 0
+
+    save = checkpoint.RunCheckpoint.save
+    num_saves = [0]
+
+    def save_then_die(self, *args):
+        num_saves[0] += 1
+        if num_saves[0] == 3:
+            # the third flush is written to --fout but never checkpointed
+            raise Killed()
+        save(self, *args)
+
+    fout = str(tmp_path / "resumed.jsonl")
+    ckpt = str(tmp_path / "run.ckpt")
+    monkeypatch.setattr(checkpoint.RunCheckpoint, "save", save_then_die)
+    with pytest.raises(Killed):
+        run(monkeypatch, corpus, fout, "--checkpoint", ckpt)
+    assert len(open(fout, "rb").read()) > 0
+    monkeypatch.setattr(checkpoint.RunCheckpoint, "save", save)
+
+    assert run(monkeypatch, corpus, fout, "--checkpoint", ckpt, "--resume") == expected
+
+
+def test_resume_without_checkpoint_keeps_output(monkeypatch, corpus, tmp_path):
+    fout = str(tmp_path / "out.jsonl")
+    open(fout, "w").write("previous output\n")
+    with pytest.raises(ValueError):
+        run(monkeypatch, corpus, fout, "--resume")
+    with pytest.raises(ValueError):
+        run(monkeypatch, corpus, fout, "--resume", "--checkpoint", str(tmp_path / "missing"))
+    assert open(fout, "r").read() == "previous output\n"
+
+
+def test_resume_refuses_rewritten_input(monkeypatch, corpus, tmp_path):
+    fout = str(tmp_path / "out.jsonl")
+    ckpt = str(tmp_path / "run.ckpt")
+    run(monkeypatch, corpus, fout, "--checkpoint", ckpt)
+    # same size, new mtime: a rewrite in place
+    st = os.stat(corpus["names"])
+    os.utime(corpus["names"], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with pytest.raises(ValueError, match="different arguments"):
+        run(monkeypatch, corpus, fout, "--checkpoint", ckpt, "--resume")
+
+
+def test_incremental_rerun_matches_clean_run(monkeypatch, corpus, tmp_path, capsys):
+    cache_dir = str(tmp_path / "incremental")
+    run(monkeypatch, corpus, str(tmp_path / "first.jsonl"), "--incremental-dir", cache_dir)
+
+    # edit one program: its first function no longer calls or assigns anything
+    parsed = pickle.load(open(corpus["parsed_in"], "rb"))
+    edited = [e for e in parsed if e["prog_name"] == "prog_3"][0]
+    edited["lmpa_exprs"] = edited["lmpa_exprs"][-1:]
+    pickle.dump(parsed, open(corpus["parsed_in"], "wb"))
+
+    capsys.readouterr()
+    rerun = run(
+        monkeypatch, corpus, str(tmp_path / "rerun.jsonl"), "--incremental-dir", cache_dir
+    )
+    assert "Incremental cache: 5 programs reused, 1 recomputed" in capsys.readouterr().out
+    assert rerun == run(monkeypatch, corpus, str(tmp_path / "clean.jsonl"))
+    assert rerun != open(str(tmp_path / "first.jsonl"), "rb").read()
+
+
+def test_rule_entries_add_up_to_program_entries(monkeypatch, corpus, tmp_path):
+    metrics_out = str(tmp_path / "metrics.json")
+    run(monkeypatch, corpus, str(tmp_path / "out.jsonl"), "--metrics-out", metrics_out)
+    run(monkeypatch, corpus, str(tmp_path / "again.jsonl"), "--metrics-out", metrics_out)
+    summary = json.load(open(metrics_out))
+    rule_entries = sum(
+        n for name, n in summary["counters"].items() if name.startswith("rule_entries/")
+    )
+    assert rule_entries > 0
+    assert rule_entries == sum(p["num_entries"] for p in summary["slowest_programs"])
+
+
+def test_static_backend_rejects_codebert_options(monkeypatch, corpus, tmp_path):
+    fout = str(tmp_path / "out.jsonl")
+    for extra in [["--quantize"], ["--device", "cpu"]]:
+        with pytest.raises(ValueError):
+            run(monkeypatch, corpus, fout, *extra)
+    with pytest.raises(ValueError):
+        run(monkeypatch, corpus, fout, static_emb_table=False)
+
+
+def test_static_table_defaults_next_to_emb_cache(monkeypatch, corpus, tmp_path):
+    emb_cache = str(tmp_path / "emb")
+    run(monkeypatch, corpus, str(tmp_path / "out.jsonl"), "--emb-cache", emb_cache, static_emb_table=False)
+    assert STATIC_TABLE_PATHS[-1] == emb_cache + ".static_table.npy"
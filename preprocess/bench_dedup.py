@@ -0,0 +1,227 @@
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from binary_prog import BinaryProgram, Function
+import dedup_dataset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark dedup_dataset on a synthetic corpus')
+    parser.add_argument('--num-bins', type=int, default=200, help='distinct binaries before duplication')
+    parser.add_argument('--funcs-per-bin', type=int, default=20)
+    parser.add_argument('--body-lines', type=int, default=20, help='statement lines per function body')
+    parser.add_argument('--dup-rate', type=float, default=0.2, help='fraction of binaries injected as near-duplicates')
+    parser.add_argument('--dup-mutation', type=float, default=0.1, help='fraction of functions renamed in a duplicate')
+    parser.add_argument('--clone-rate', type=float, default=0.05, help='fraction of functions cloned into another binary')
+    parser.add_argument('--dedup-ratio', type=float, default=0.7)
+    parser.add_argument('--leak-threshold', type=int, default=90, help='body ratio that counts as a detected leak')
+    parser.add_argument('--num-workers', type=int, default=1)
+    parser.add_argument('--prefilter', type=str, default='names', choices=['names', 'minhash'])
+    parser.add_argument('--minhash-threshold', type=float, default=0.5)
+    parser.add_argument('--debug-skipped', action='store_true', help='keep name lists of skipped bins in the names pre-filter')
+    parser.add_argument('--prefilter-only', action='store_true', help='stop after the pre-filter, e.g. for memory comparisons on large corpora')
+    parser.add_argument('--compare-seen-stores', action='store_true', help='report memory of a str set vs NameHashSet over all function names')
+    parser.add_argument('--no-hash-index', action='store_true', help='fuzzy-match every test function, without the body hash tiers')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='skip peak memory tracking (it slows stages down)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json-out', type=str, default='')
+    args = parser.parse_args()
+    return args
+
+
+WORDS = ['buf', 'len', 'count', 'idx', 'node', 'list', 'ptr', 'size', 'name', 'file',
+         'ctx', 'key', 'value', 'entry', 'data', 'result', 'offset', 'flags', 'path', 'str']
+
+
+def gen_func(stripped_name, gt_name, callees, body_lines, rng):
+    num_vars = rng.randint(2, 6)
+    var_id_maps = {}
+    for i in range(num_vars):
+        var_id_maps['v%d' % (i + 1)] = '%s_%s' % (rng.choice(WORDS), rng.choice(WORDS))
+    lines = ['__int64 __fastcall %s(__int64 a1)' % stripped_name, '{']
+    for i in range(num_vars):
+        lines.append('  __int64 v%d; // rax' % (i + 1))
+    for _ in range(body_lines):
+        dst = rng.randint(1, num_vars)
+        src = rng.randint(1, num_vars)
+        if len(callees) > 0 and rng.random() < 0.2:
+            lines.append('  v%d = %s(v%d);' % (dst, rng.choice(callees)[0], src))
+        else:
+            lines.append('  v%d = v%d + %d;' % (dst, src, rng.randint(0, 4096)))
+    lines.append('  return v1;')
+    lines.append('}')
+    func_id_maps = {stripped_name: gt_name}
+    for callee_stripped, callee_gt in callees:
+        func_id_maps[callee_stripped] = callee_gt
+    return Function(stripped_name, '\n'.join(lines), var_id_maps, func_id_maps)
+
+
+def new_bin(prog_name, stripped_name2func):
+    bin_prog = BinaryProgram.__new__(BinaryProgram)
+    bin_prog.prog_name = prog_name
+    bin_prog.stripped_name2func = stripped_name2func
+    return bin_prog
+
+
+def gen_corpus(args, rng):
+    """
+    Returns the corpus, the (original, duplicate) binary pairs and the
+    cloned function pairs, ((prog, func), (prog, func))
+    """
+    bins = []
+    for b in range(args.num_bins):
+        names = [('sub_%X' % (0x401000 + i * 0x40), 'bin%d_func%d' % (b, i)) for i in range(args.funcs_per_bin)]
+        funcs = {}
+        for i, (stripped_name, gt_name) in enumerate(names):
+            callees = rng.sample(names, min(2, len(names)))
+            funcs[stripped_name] = gen_func(stripped_name, gt_name, callees, args.body_lines, rng)
+        bins.append(new_bin('prog_%05d' % b, funcs))
+
+    clone_pairs = []
+    num_clones = int(args.num_bins * args.funcs_per_bin * args.clone_rate)
+    for c in range(num_clones):
+        src_bin, dst_bin = rng.sample(bins, 2)
+        src_name = rng.choice(list(src_bin.stripped_name2func.keys()))
+        src = src_bin.stripped_name2func[src_name]
+        clone_name = 'sub_%X' % (0x500000 + c * 0x40)
+        # e.g. a statically linked library function: same name, body and
+        # variables at a new address in another binary
+        func_id_maps = dict(src.func_id_maps)
+        del func_id_maps[src_name]
+        func_id_maps[clone_name] = src.func_id_maps[src_name]
+        body = src.body.replace(src_name, clone_name)
+        dst_bin.stripped_name2func[clone_name] = Function(clone_name, body, dict(src.var_id_maps), func_id_maps)
+        clone_pairs.append(((src_bin.prog_name, src_name), (dst_bin.prog_name, clone_name)))
+
+    dup_pairs = []
+    num_dups = int(args.num_bins * args.dup_rate)
+    for d in range(num_dups):
+        src_bin = rng.choice(bins[:args.num_bins])
+        funcs = {}
+        for stripped_name, func in src_bin.stripped_name2func.items():
+            func_id_maps = dict(func.func_id_maps)
+            if rng.random() < args.dup_mutation:
+                func_id_maps[stripped_name] = 'dup%d_%s' % (d, func_id_maps[stripped_name])
+            funcs[stripped_name] = Function(stripped_name, func.body, dict(func.var_id_maps), func_id_maps)
+        dup_name = 'prog_dup_%05d' % d
+        bins.append(new_bin(dup_name, funcs))
+        dup_pairs.append((src_bin.prog_name, dup_name))
+    rng.shuffle(bins)
+    return bins, dup_pairs, clone_pairs
+
+
+def run_stage(name, fn, use_tracemalloc, report):
+    if use_tracemalloc:
+        tracemalloc.start()
+    begin = time.perf_counter()
+    ret = fn()
+    seconds = time.perf_counter() - begin
+    peak_mb = 0
+    if use_tracemalloc:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    report[name] = {'seconds': seconds, 'peak_mb': peak_mb}
+    return ret
+
+
+def compare_seen_stores(bins):
+    """
+    Time and traced memory of adding all function names to a set of str
+    and to a NameHashSet
+    """
+    names = []
+    for bin_prog in bins:
+        names.extend(dedup_dataset.bin_func_names(bin_prog))
+    report = {}
+    for store_name, store_cls in [('set', set), ('hash_table', dedup_dataset.NameHashSet)]:
+        # copies, as names read from pickled shards are separate objects
+        # whose str hash is not computed yet
+        copies = [''.join(name) for name in names]
+        store = store_cls()
+        begin = time.perf_counter()
+        for name in copies:
+            store.add(name)
+        seconds = time.perf_counter() - begin
+        del store, copies
+        tracemalloc.start()
+        store = store_cls()
+        for name in names:
+            store.add(''.join(name))
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        report[store_name] = {'num_names': len(store), 'seconds': seconds, 'mb': current / 2 ** 20}
+        del store
+    return report
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    use_tracemalloc = not args.no_tracemalloc
+    bins, dup_pairs, clone_pairs = gen_corpus(args, rng)
+    num_funcs = sum(len(b.stripped_name2func) for b in bins)
+    print("Corpus: %d bins, %d funcs, %d duplicate bins, %d cloned funcs" % (len(bins), num_funcs, len(dup_pairs), len(clone_pairs)))
+
+    stages = {}
+    if args.prefilter == 'minhash':
+        kept, skipped = run_stage('prefilter', lambda: dedup_dataset.prefilter_bins_minhash(bins, threshold=args.minhash_threshold, num_workers=args.num_workers), use_tracemalloc, stages)
+    else:
+        kept, skipped = run_stage('prefilter', lambda: dedup_dataset.prefilter_bins(bins, args.dedup_ratio, debug=args.debug_skipped), use_tracemalloc, stages)
+    # a duplicate pair is caught if at most one of the two binaries survives
+    kept_names = set(b.prog_name for b in kept)
+    dups_caught = sum(1 for a, b in dup_pairs if not (a in kept_names and b in kept_names))
+    report = {
+        'num_bins': len(bins),
+        'num_funcs': num_funcs,
+        'num_workers': args.num_workers,
+        'prefilter': args.prefilter,
+        'num_kept': len(kept),
+        'stages': stages,
+        'dup_recall': dups_caught / max(len(dup_pairs), 1),
+    }
+
+    if not args.prefilter_only:
+        train_bins, test_bins = dedup_dataset.split_bins(kept)
+        train_store, test_store = run_stage('normalize', lambda: (dedup_dataset.normalize_bins(train_bins, 'Normalizing train', num_workers=args.num_workers), dedup_dataset.normalize_bins(test_bins, 'Normalizing test', num_workers=args.num_workers)), use_tracemalloc, stages)
+        train_name_list2funcs, train_body_index = run_stage('index', lambda: (dedup_dataset.index_train_funcs(train_bins), None if args.no_hash_index else dedup_dataset.index_train_bodies(train_bins, train_store)), use_tracemalloc, stages)
+        test_overlaps, tier_counts = run_stage('leakage', lambda: dedup_dataset.scan_leakage(test_bins, test_store, train_store, train_name_list2funcs, train_body_index, num_workers=args.num_workers), use_tracemalloc, stages)
+
+        # a clone pair is a leak if one side is in train and the other in test
+        train_names = set(b.prog_name for b in train_bins)
+        test_names = set(b.prog_name for b in test_bins)
+        detected = set()
+        for test_key, might_overlapped in test_overlaps:
+            for train_func, _, body_ratio in might_overlapped:
+                if body_ratio >= args.leak_threshold:
+                    detected.add((test_key, train_func))
+        leaks = []
+        for a, b in clone_pairs:
+            if a[0] in train_names and b[0] in test_names:
+                leaks.append((b, a))
+            elif b[0] in train_names and a[0] in test_names:
+                leaks.append((a, b))
+        leaks_caught = sum(1 for leak in leaks if leak in detected)
+        report['tier_counts'] = tier_counts
+        report['num_leaks'] = len(leaks)
+        report['leak_recall'] = leaks_caught / max(len(leaks), 1)
+
+    for name, stage in stages.items():
+        print("%-10s %8.3fs  peak %8.1f MB" % (name, stage['seconds'], stage['peak_mb']))
+    print("Kept %d of %d bins" % (len(kept), len(bins)))
+    print("Duplicate bins caught by pre-filter: %d/%d (%.3f)" % (dups_caught, len(dup_pairs), report['dup_recall']))
+    if not args.prefilter_only:
+        for tier in ['exact', 'canonical', 'fuzzy']:
+            print("Resolved by %-9s %6d test functions %8d pairs" % (tier, tier_counts[tier]['funcs'], tier_counts[tier]['pairs']))
+        print("Injected leaks detected: %d/%d (%.3f)" % (leaks_caught, len(leaks), report['leak_recall']))
+    if args.compare_seen_stores:
+        report['seen_stores'] = compare_seen_stores(bins)
+        for store_name, r in report['seen_stores'].items():
+            print("seen names as %-10s %8d names %8.3fs %8.2f MB" % (store_name, r['num_names'], r['seconds'], r['mb']))
+    if args.json_out:
+        json.dump(report, open(args.json_out, 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main()
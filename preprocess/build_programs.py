@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import pickle
+import time
+from multiprocessing import Pool
+from tqdm import tqdm
+from binary_prog import BinaryProgram
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build pickled BinaryProgram shards from decompiler output')
+    parser.add_argument('--fin', type=str, required=True, help='list of JSONL shards, one {"prog_name": ..., "funcs": [...]} per line')
+    parser.add_argument('--out-dir', type=str, required=True, help='directory of the pickled BinaryProgram shards')
+    parser.add_argument('--fout', type=str, required=True, help='list of written shards, usable as --fin of dedup_dataset.py')
+    parser.add_argument('--num-workers', type=int, default=32)
+    args = parser.parse_args()
+    return args
+
+
+def build_shard(job):
+    """
+    Build the BinaryPrograms of one JSONL shard and pickle them as a list
+    """
+    shard_path, out_path = job
+    begin = time.time()
+    bins = []
+    num_funcs = 0
+    with open(shard_path, 'r') as fin:
+        for line in fin:
+            if line.strip() == '':
+                continue
+            raw = json.loads(line)
+            bin_prog = BinaryProgram(raw['prog_name'], raw['funcs'])
+            num_funcs += len(bin_prog.stripped_name2func)
+            bins.append(bin_prog)
+    with open(out_path, 'wb') as fout:
+        pickle.dump(bins, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    return out_path, len(bins), num_funcs, time.time() - begin
+
+
+def build_programs(shard_paths, out_dir, num_workers=1):
+    """
+    Returns the written shard paths, in the order of `shard_paths`
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = []
+    for i, shard_path in enumerate(shard_paths):
+        name = os.path.splitext(os.path.basename(shard_path))[0]
+        jobs.append((shard_path, os.path.join(out_dir, '%05d_%s.pkl' % (i, name))))
+
+    begin = time.time()
+    if num_workers <= 1:
+        results = list(tqdm(map(build_shard, jobs), total=len(jobs), desc='Building programs'))
+    else:
+        with Pool(num_workers) as p:
+            results = list(tqdm(p.imap(build_shard, jobs), total=len(jobs), desc='Building programs'))
+    out_paths = [r[0] for r in results]
+    num_bins = sum(r[1] for r in results)
+    num_funcs = sum(r[2] for r in results)
+    worker_seconds = sum(r[3] for r in results)
+    elapsed = max(time.time() - begin, 1e-9)
+    print("Built %d programs (%d functions) from %d shards in %.1fs: %.1f programs/s, %.1f programs/s per worker" % (num_bins, num_funcs, len(jobs), elapsed, num_bins / elapsed, num_bins / max(worker_seconds, 1e-9)))
+    return out_paths
+
+
+def main():
+    args = parse_args()
+    shard_paths = [f.strip() for f in open(args.fin).readlines() if f.strip() != '']
+    out_paths = build_programs(shard_paths, args.out_dir, num_workers=args.num_workers)
+    with open(args.fout, 'w') as fout:
+        for out_path in out_paths:
+            fout.write(out_path + '\n')
+
+
+if __name__ == '__main__':
+    main()
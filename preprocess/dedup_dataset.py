@@ -1,42 +1,162 @@
 import argparse
+import hashlib
 import json
 import os
+import re
 import sys
+from multiprocessing import Pool
 from tqdm import tqdm
 import pickle
+import time
 from binary_prog import BinaryProgram, Function
 from fuzzywuzzy import fuzz
 import name_utils
+import numpy as np
 
 
 def get_fuzzy_ratio(name1, name2):
     return fuzz.ratio(name1, name2)
 
-parser = argparse.ArgumentParser(description='Deduplicate dataset')
-parser.add_argument('--fin', type=str, default='', help='ds file list')
-parser.add_argument('--dedup-ratio', type=float, default=0.7, help='deduplication threshold')
-args = parser.parse_args()
 
-data_files = open(args.fin).readlines()
+def parse_args():
+    parser = argparse.ArgumentParser(description='Deduplicate dataset')
+    parser.add_argument('--fin', type=str, default='', help='ds file list')
+    parser.add_argument('--dedup-ratio', type=float, default=0.7, help='deduplication threshold')
+    parser.add_argument('--train-out', type=str, required=True, help='pickled train BinaryPrograms')
+    parser.add_argument('--test-out', type=str, required=True, help='pickled test BinaryPrograms')
+    parser.add_argument('--test-overlap-out', type=str, required=True, help='json of test functions and their overlapping train functions')
+    parser.add_argument('--num-workers', type=int, default=32)
+    parser.add_argument('--skipped-out', type=str, default='', help='json of the binaries dropped by the pre-filter')
+    parser.add_argument('--debug-skipped', action='store_true', help='with --skipped-out, write the name lists of binaries skipped by the names pre-filter')
+    parser.add_argument('--prefilter', type=str, default='names', choices=['names', 'minhash'], help='order-dependent seen-name filter, or MinHash-LSH clustering of binaries')
+    parser.add_argument('--minhash-perm', type=int, default=128, help='MinHash signature length')
+    parser.add_argument('--minhash-bands', type=int, default=32, help='LSH bands, must divide --minhash-perm')
+    parser.add_argument('--minhash-threshold', type=float, default=0.5, help='estimated Jaccard similarity of function name sets to merge two binaries')
+    args = parser.parse_args()
+    return args
+
+
+def load_bins(fin):
+    """
+    Load the pickled BinaryProgram shards listed in `fin`, in list order.
+    Loading stays in this process: a worker would unpickle a shard only to
+    pickle it again for the way back, so only the CPU stages use the pool.
+    """
+    data_files = [f.strip() for f in open(fin).readlines()]
+    data_files = [f for f in data_files if os.path.exists(f)]
+
+    bins = []
+    for f in tqdm(data_files, desc='Loading shards'):
+        with open(f, 'rb') as fin_shard:
+            bins.extend(pickle.load(fin_shard))
+    return bins
+
+
+def name_hash(name):
+    # str hashes are salted per process, which is fine for a table that never
+    # leaves it, and cached on the str; 0 marks an empty slot of NameHashSet
+    return (hash(name) & 0xFFFFFFFFFFFFFFFF) or 1
+
+
+class NameHashSet:
+    """
+    Set of 64-bit name hashes in a numpy open-addressing table with linear
+    probing, grown to keep the load factor under 1/2
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.slots = np.zeros(capacity, dtype=np.uint64)
+        self.mask = capacity - 1
+        self.size = 0
+
+    def _insert(self, h):
+        slots = self.slots
+        i = h & self.mask
+        while True:
+            slot = slots.item(i)
+            if slot == h:
+                return False
+            if slot == 0:
+                slots[i] = h
+                return True
+            i = (i + 1) & self.mask
 
-bins = []
-for f in tqdm(data_files):
-    f = f.strip()
-    if not os.path.exists(f):
-        continue
-    with open(f, 'rb') as fin:
-        bins.extend(pickle.load(fin))
+    def _grow(self):
+        old = self.slots[self.slots != 0]
+        self.slots = np.zeros(len(self.slots) * 2, dtype=np.uint64)
+        self.mask = len(self.slots) - 1
+        for h in old.tolist():
+            self._insert(h)
+
+    def add(self, name):
+        """
+        Returns True if `name` was not in the set yet
+        """
+        if (self.size + 1) * 2 > len(self.slots):
+            self._grow()
+        added = self._insert(name_hash(name))
+        if added:
+            self.size += 1
+        return added
+
+    def __contains__(self, name):
+        h = name_hash(name)
+        slots = self.slots
+        i = h & self.mask
+        while True:
+            slot = slots.item(i)
+            if slot == h:
+                return True
+            if slot == 0:
+                return False
+            i = (i + 1) & self.mask
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self.slots.nbytes
 
 
 # use function name to pre-filter
-        
-pre_filtered_bins = []
-skipped_bins = []
-seen_func_names = set()
-for bin_prog in tqdm(bins):
-    current_func_names = []
-    not_seen_func_names = []
-    current_seen_names = []
+def prefilter_bins(bins, dedup_ratio, debug=False):
+    """
+    Keep a binary if more than `dedup_ratio` of its function names were not
+    seen in earlier binaries. Skipped binaries are recorded as (prog_name,
+    #not seen, #seen, #names), or with the name lists instead of the counts
+    if `debug`.
+    """
+    pre_filtered_bins = []
+    skipped_bins = []
+    seen_func_names = NameHashSet()
+    for bin_prog in tqdm(bins):
+        current_func_names = []
+        not_seen_func_names = []
+        current_seen_names = []
+        for stripped_name, func in bin_prog.stripped_name2func.items():
+            if stripped_name not in func.func_id_maps:
+                func_name = stripped_name
+            else:
+                func_name = func.func_id_maps[stripped_name]
+            if func_name == 'main':
+                continue
+            current_func_names.append(func_name)
+            if seen_func_names.add(func_name):
+                not_seen_func_names.append(func_name)
+            else:
+                current_seen_names.append(func_name)
+        if len(not_seen_func_names) > len(current_func_names) * dedup_ratio:
+            pre_filtered_bins.append(bin_prog)
+        elif debug:
+            skipped_bins.append((bin_prog.prog_name, not_seen_func_names, current_seen_names, current_func_names))
+        else:
+            skipped_bins.append((bin_prog.prog_name, len(not_seen_func_names), len(current_seen_names), len(current_func_names)))
+    return pre_filtered_bins, skipped_bins
+
+
+def bin_func_names(bin_prog):
+    func_names = set()
     for stripped_name, func in bin_prog.stripped_name2func.items():
         if stripped_name not in func.func_id_maps:
             func_name = stripped_name
@@ -44,30 +164,120 @@ for bin_prog in tqdm(bins):
             func_name = func.func_id_maps[stripped_name]
         if func_name == 'main':
             continue
-        current_func_names.append(func_name)
-        if func_name not in seen_func_names:
-            not_seen_func_names.append(func_name)
-            seen_func_names.add(func_name)
+        func_names.add(func_name)
+    return func_names
+
+
+# largest prime below 2^32, so (a * h + b) with a, b, h < p fits in uint64
+_MINHASH_PRIME = 4294967291
+
+
+def minhash_permutations(num_perm, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, _MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _minhash_signature(args):
+    func_names, a, b = args
+    if len(func_names) == 0:
+        return None
+    hashes = np.array([int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little') % _MINHASH_PRIME for name in sorted(func_names)], dtype=np.uint64)
+    permuted = (np.outer(hashes, a) + b) % np.uint64(_MINHASH_PRIME)
+    return permuted.min(axis=0)
+
+
+def minhash_signatures(bins, num_perm=128, num_workers=1, seed=1):
+    """
+    MinHash signature of each binary's function name set, None for binaries
+    without named functions
+    """
+    a, b = minhash_permutations(num_perm, seed)
+    jobs = ((bin_func_names(bin_prog), a, b) for bin_prog in bins)
+    if num_workers <= 1:
+        return [_minhash_signature(job) for job in tqdm(jobs, total=len(bins), desc='MinHash')]
+    with Pool(num_workers) as p:
+        return list(tqdm(p.imap(_minhash_signature, jobs, chunksize=64), total=len(bins), desc='MinHash'))
+
+
+def _find_root(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def minhash_clusters(signatures, num_bands=32, threshold=0.5, max_bucket_reps=16):
+    """
+    Union-find clusters of binaries that share an LSH band bucket and whose
+    estimated Jaccard similarity reaches `threshold`. Within a bucket, each
+    member is compared with one representative per cluster already seen
+    there (at most `max_bucket_reps`), not with every other member.
+    """
+    parents = list(range(len(signatures)))
+    # visit binaries by signature so the clusters do not depend on the input order
+    valid = sorted((i for i, sig in enumerate(signatures) if sig is not None), key=lambda i: signatures[i].tobytes())
+    if len(valid) == 0:
+        return parents
+    rows = len(signatures[valid[0]]) // num_bands
+    for band in range(num_bands):
+        buckets = {}
+        for i in valid:
+            buckets.setdefault(signatures[i][band * rows:(band + 1) * rows].tobytes(), []).append(i)
+        for members in buckets.values():
+            # a bucket may also hold unrelated binaries that collide in this
+            # band, hence one representative per cluster rather than the first member
+            reps = []
+            for i in members:
+                matched = False
+                for j in reps:
+                    root_i = _find_root(parents, i)
+                    root_j = _find_root(parents, j)
+                    if root_i == root_j:
+                        matched = True
+                    elif np.mean(signatures[i] == signatures[j]) >= threshold:
+                        parents[root_i] = root_j
+                        matched = True
+                if not matched and len(reps) < max_bucket_reps:
+                    reps.append(i)
+    return [_find_root(parents, i) for i in range(len(signatures))]
+
+
+def prefilter_bins_minhash(bins, num_perm=128, num_bands=32, threshold=0.5, num_workers=1):
+    """
+    Keep one binary per MinHash-LSH cluster, the one with the smallest
+    prog_name, so the result does not depend on the order of `bins`
+    """
+    if num_perm % num_bands != 0:
+        raise ValueError('--minhash-perm (%d) must be a multiple of --minhash-bands (%d)' % (num_perm, num_bands))
+    signatures = minhash_signatures(bins, num_perm=num_perm, num_workers=num_workers)
+    roots = minhash_clusters(signatures, num_bands=num_bands, threshold=threshold)
+    representative = {}
+    for i, root in enumerate(roots):
+        if root not in representative or bins[i].prog_name < bins[representative[root]].prog_name:
+            representative[root] = i
+    pre_filtered_bins = []
+    skipped_bins = []
+    for i, root in enumerate(roots):
+        if representative[root] == i:
+            pre_filtered_bins.append(bins[i])
         else:
-            current_seen_names.append(func_name)
-    if len(not_seen_func_names) > len(current_func_names) * args.dedup_ratio:
-        pre_filtered_bins.append(bin_prog)
-    else:
-        skipped_bins.append((bin_prog, not_seen_func_names, current_seen_names, current_func_names))
-    
+            skipped_bins.append((bins[i].prog_name, bins[representative[root]].prog_name))
+    return pre_filtered_bins, skipped_bins
 
-print("Original bins: %d, after filtering: %d, kept ratio: %.2f" % (len(bins), len(pre_filtered_bins), len(pre_filtered_bins) / len(bins)))
 
+def split_bins(bins, train_ratio=0.9, seed=42):
+    bins_sorted = sorted(bins, key=lambda x: x.prog_name, reverse=True)
 
-bins_sorted = sorted(pre_filtered_bins, key=lambda x: x.prog_name, reverse=True)
+    # shuffle with seed 42
+    np.random.seed(seed)
+    bins_shuffled = np.random.permutation(bins_sorted)
 
-# shuffle with seed 42
-import numpy as np
-np.random.seed(42)
-bins_shuffled = np.random.permutation(bins_sorted)
+    train_bins = list(bins_shuffled[:int(len(bins_shuffled) * train_ratio)])
+    test_bins = list(bins_shuffled[int(len(bins_shuffled) * train_ratio):])
+    return train_bins, test_bins
 
-train_bins = list(bins_shuffled[:int(len(bins_shuffled) * 0.9)])
-test_bins = list(bins_shuffled[int(len(bins_shuffled) * 0.9):])
 
 def norm_func_body(func):
     new_body = func.body
@@ -77,15 +287,84 @@ def norm_func_body(func):
         new_body = name_utils.replace_variable_names(new_body, k, v)
     return new_body
 
-for bin_prog in tqdm(train_bins, desc='Normalizing train dataset'):
-    for stripped_name, func in bin_prog.stripped_name2func.items():
-        func.norm_body = norm_func_body(func)
 
-for bin_prog in tqdm(test_bins, desc='Normalizing test dataset'):
-    for stripped_name, func in bin_prog.stripped_name2func.items():
-        func.norm_body = norm_func_body(func)
+class NormBodyStore:
+    """
+    Normalized bodies of many functions, utf-8 encoded back to back in one
+    buffer and looked up by (prog_name, stripped_name)
+    """
+
+    def __init__(self):
+        self.key2idx = {}
+        self.blob = bytearray()
+        self.offsets = [0]
+
+    def extend(self, keys, blob, lengths):
+        for key, length in zip(keys, lengths):
+            self.key2idx[key] = len(self.offsets) - 1
+            self.offsets.append(self.offsets[-1] + length)
+        self.blob.extend(blob)
+
+    def finalize(self):
+        self.blob = bytes(self.blob)
+        self.offsets = np.array(self.offsets, dtype=np.int64)
+
+    def get(self, key):
+        idx = self.key2idx[key]
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].decode('utf-8')
+
+    def __len__(self):
+        return len(self.key2idx)
+
+
+def _norm_batch(funcs):
+    encoded = [norm_func_body(func).encode('utf-8') for func in funcs]
+    return b''.join(encoded), [len(e) for e in encoded]
+
+
+def normalize_bins(bins, desc, num_workers=1, batch_size=256):
+    """
+    Normalize every function of `bins` in batches of `batch_size` functions
+    over `num_workers` processes. Bodies are keyed by (prog_name,
+    stripped_name), so prog_name must be unique within `bins`.
+    """
+    keys = []
+    batches = []
+    current = []
+    prog_names = set()
+    for bin_prog in bins:
+        if bin_prog.prog_name in prog_names:
+            raise ValueError('prog_name %s appears in more than one binary' % bin_prog.prog_name)
+        prog_names.add(bin_prog.prog_name)
+        for stripped_name, func in bin_prog.stripped_name2func.items():
+            keys.append((bin_prog.prog_name, stripped_name))
+            current.append(func)
+            if len(current) == batch_size:
+                batches.append(current)
+                current = []
+    if len(current) > 0:
+        batches.append(current)
+
+    store = NormBodyStore()
+    begin = time.time()
+    pos = 0
+    if num_workers <= 1:
+        results = map(_norm_batch, batches)
+        for blob, lengths in tqdm(results, total=len(batches), desc=desc):
+            store.extend(keys[pos:pos + len(lengths)], blob, lengths)
+            pos += len(lengths)
+    else:
+        with Pool(num_workers) as p:
+            results = p.imap(_norm_batch, batches)
+            for blob, lengths in tqdm(results, total=len(batches), desc=desc):
+                store.extend(keys[pos:pos + len(lengths)], blob, lengths)
+                pos += len(lengths)
+    store.finalize()
+    elapsed = max(time.time() - begin, 1e-9)
+    num_cores = max(num_workers, 1)
+    print("%s: %d functions in %.1fs, %.0f funcs/s, %.0f funcs/s/core" % (desc, len(keys), elapsed, len(keys) / elapsed, len(keys) / elapsed / num_cores))
+    return store
 
-print("Train bins: %d, Test bins: %d" % (len(train_bins), len(test_bins)))
 
 def func2name_list(func):
     my_name = func.func_name
@@ -95,58 +374,212 @@ def func2name_list(func):
     sorted_names = sorted(names)
     return '#'.join(sorted_names)
 
-train_prog_func2entry = {}
-train_prog_func2name_list = {}
-train_name_list2funcs = {}
-for train_bin in tqdm(train_bins):
-    for stripped_name, func in train_bin.stripped_name2func.items():                        
-        train_prog_func2entry[(train_bin.prog_name, stripped_name)] = func        
-        name_list = func2name_list(func)
-        train_prog_func2name_list[(train_bin.prog_name, stripped_name)] = name_list
-        if name_list not in train_name_list2funcs:
-            train_name_list2funcs[name_list] = []
-        train_name_list2funcs[name_list].append((train_bin.prog_name, stripped_name))
-        
-
-def get_test_overlaps(start_idx, end_idx):
+
+def index_train_funcs(train_bins):
+    train_name_list2funcs = {}
+    for train_bin in tqdm(train_bins):
+        for stripped_name, func in train_bin.stripped_name2func.items():
+            name_list = func2name_list(func)
+            if name_list not in train_name_list2funcs:
+                train_name_list2funcs[name_list] = []
+            train_name_list2funcs[name_list].append((train_bin.prog_name, stripped_name))
+    return train_name_list2funcs
+
+
+# string/char literals, numbers and whitespace, collapsed by canonical_body
+_literal_pattern = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|\b(?:0[xX][0-9a-fA-F]+|\d+)[uUlLiI0-9]*\b')
+_whitespace_pattern = re.compile(r'\s+')
+
+
+def canonical_body(norm_body):
+    body = _literal_pattern.sub('0', norm_body)
+    return _whitespace_pattern.sub('', body)
+
+
+def _body_hash(body):
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=16).digest()
+
+
+def index_train_bodies(train_bins, train_store):
+    """
+    Hashes of the normalized and of the canonical body of every train
+    function, each mapping to [(train_func, name_list), ...]
+    """
+    exact2funcs = {}
+    canonical2funcs = {}
+    for train_bin in tqdm(train_bins, desc='Hashing train bodies'):
+        for stripped_name, func in train_bin.stripped_name2func.items():
+            key = (train_bin.prog_name, stripped_name)
+            norm_body = train_store.get(key)
+            entry = (key, func2name_list(func))
+            exact2funcs.setdefault(_body_hash(norm_body), []).append(entry)
+            canonical2funcs.setdefault(_body_hash(canonical_body(norm_body)), []).append(entry)
+    return exact2funcs, canonical2funcs
+
+
+def _new_tier_counts():
+    return {tier: {'funcs': 0, 'pairs': 0} for tier in ['exact', 'canonical', 'fuzzy']}
+
+
+def find_test_overlaps(test_bins, test_store, train_store, train_name_list2funcs, train_body_index=None):
+    """
+    Returns the overlaps of every test function, [(train_func, name_ratio,
+    body_ratio), ...], and the number of test functions and of pairs each
+    tier resolved. With `train_body_index` (from index_train_bodies), a test
+    function whose normalized or canonical body hash matches train functions
+    is resolved by the hash alone: its overlaps are exactly those train
+    functions, whatever their name ratio, and the scan over all train name
+    lists is skipped. Normalized-hash matches ('exact') get body ratio 100,
+    canonical-only matches ('canonical') their fuzzy body ratio. Every other
+    function ('fuzzy') is compared with the train functions whose name list
+    ratio is above 90.
+    """
     test_overlaps = []
-    for test_bin in tqdm(test_bins[start_idx:end_idx]):
-        for stripped_name, func in test_bin.stripped_name2func.items():                        
+    tier_counts = _new_tier_counts()
+    for test_bin in tqdm(test_bins):
+        for stripped_name, func in test_bin.stripped_name2func.items():
             name_list = func2name_list(func)
+            norm_body = test_store.get((test_bin.prog_name, stripped_name))
             might_overlapped = []
+            if train_body_index is not None:
+                exact2funcs, canonical2funcs = train_body_index
+                exact_hits = exact2funcs.get(_body_hash(norm_body), [])
+                for train_func, train_name in exact_hits:
+                    name_ratio = 100 if train_name == name_list else get_fuzzy_ratio(name_list, train_name)
+                    might_overlapped.append((train_func, name_ratio, 100))
+                exact_funcs = set(train_func for train_func, _ in exact_hits)
+                # the canonical body is derived from the normalized one, so this also holds the exact matches
+                num_canonical = 0
+                for train_func, train_name in canonical2funcs.get(_body_hash(canonical_body(norm_body)), []):
+                    if train_func in exact_funcs:
+                        continue
+                    name_ratio = 100 if train_name == name_list else get_fuzzy_ratio(name_list, train_name)
+                    might_overlapped.append((train_func, name_ratio, get_fuzzy_ratio(norm_body, train_store.get(train_func))))
+                    num_canonical += 1
+                if len(might_overlapped) > 0:
+                    tier = 'exact' if len(exact_hits) > 0 else 'canonical'
+                    tier_counts[tier]['funcs'] += 1
+                    tier_counts['exact']['pairs'] += len(exact_hits)
+                    tier_counts['canonical']['pairs'] += num_canonical
+                    test_overlaps.append(((test_bin.prog_name, stripped_name), might_overlapped))
+                    continue
+
             if name_list in train_name_list2funcs:
                 for train_func in train_name_list2funcs[name_list]:
-                    might_overlapped.append((train_func, 100, get_fuzzy_ratio(func.norm_body, train_prog_func2entry[train_func].norm_body)))
+                    might_overlapped.append((train_func, 100, get_fuzzy_ratio(norm_body, train_store.get(train_func))))
             for train_name, train_funcs in train_name_list2funcs.items():
                 name_ratio = get_fuzzy_ratio(name_list, train_name)
                 if name_ratio > 90:
                     for train_func in train_funcs:
-                        might_overlapped.append((train_func, name_ratio, get_fuzzy_ratio(func.norm_body, train_prog_func2entry[train_func].norm_body)))
+                        might_overlapped.append((train_func, name_ratio, get_fuzzy_ratio(norm_body, train_store.get(train_func))))
+            tier_counts['fuzzy']['funcs'] += 1
+            tier_counts['fuzzy']['pairs'] += len(might_overlapped)
 
             test_overlaps.append(((test_bin.prog_name, stripped_name), might_overlapped))
-    return test_overlaps
+    return test_overlaps, tier_counts
 
-all_lens = len(test_bins)
-NUM_WORKERS = 32
-step = all_lens // NUM_WORKERS
-intervals = [(i * step, (i + 1) * step) for i in range(NUM_WORKERS)]
-intervals[-1] = (intervals[-1][0], all_lens)
 
-import multiprocessing
-from multiprocessing import Pool
+# stores and train indices of a leakage worker, set by _init_leakage_worker
+_worker_test_store = None
+_worker_train_store = None
+_worker_train_name_list2funcs = {}
+_worker_train_body_index = None
+
+
+def _init_leakage_worker(test_store, train_store, train_name_list2funcs, train_body_index):
+    global _worker_test_store, _worker_train_store, _worker_train_name_list2funcs, _worker_train_body_index
+    _worker_test_store = test_store
+    _worker_train_store = train_store
+    _worker_train_name_list2funcs = train_name_list2funcs
+    _worker_train_body_index = train_body_index
+
+
+def _scan_leakage_chunk(test_bins_chunk):
+    return find_test_overlaps(test_bins_chunk, _worker_test_store, _worker_train_store, _worker_train_name_list2funcs, _worker_train_body_index)
+
+
+def scan_leakage(test_bins, test_store, train_store, train_name_list2funcs, train_body_index=None, num_workers=1):
+    """
+    find_test_overlaps over `num_workers` processes. The train indices are
+    handed to each worker once; results keep the order of `test_bins`.
+    """
+    if num_workers <= 1:
+        return find_test_overlaps(test_bins, test_store, train_store, train_name_list2funcs, train_body_index)
+    num_chunks = min(len(test_bins), num_workers * 4)
+    if num_chunks == 0:
+        return [], _new_tier_counts()
+    step = (len(test_bins) + num_chunks - 1) // num_chunks
+    chunks = [test_bins[i:i + step] for i in range(0, len(test_bins), step)]
+    with Pool(num_workers, initializer=_init_leakage_worker, initargs=(test_store, train_store, train_name_list2funcs, train_body_index)) as p:
+        res = p.map(_scan_leakage_chunk, chunks)
+
+    test_overlaps = []
+    tier_counts = _new_tier_counts()
+    for r, counts in res:
+        test_overlaps.extend(r)
+        for tier, n in counts.items():
+            tier_counts[tier]['funcs'] += n['funcs']
+            tier_counts[tier]['pairs'] += n['pairs']
+    return test_overlaps, tier_counts
+
+
+def write_outputs(train_bins, test_bins, test_overlaps, train_out, test_out, test_overlap_out):
+    """
+    The pickled binaries carry no normalized bodies (no `norm_body` on their
+    functions); norm_func_body recomputes one
+    """
+    new_ds_overlap = open(test_overlap_out, 'w')
+    json.dump(test_overlaps, new_ds_overlap)
+    new_ds_overlap.close()
+
+    # output train and test dataset
+    pickle.dump(train_bins, open(train_out, 'wb'))
+    pickle.dump(test_bins, open(test_out, 'wb'))
+    print("Output train dataset to %s, test dataset to %s" % (train_out, test_out))
+
+
+def run_pipeline(fin, dedup_ratio, train_out, test_out, test_overlap_out, num_workers=1, prefilter='names', minhash_perm=128, minhash_bands=32, minhash_threshold=0.5, skipped_out='', debug_skipped=False):
+    """
+    load -> prefilter -> split -> normalize -> leakage scan -> write
+    """
+    if debug_skipped and not skipped_out:
+        raise ValueError('--debug-skipped needs --skipped-out')
+    bins = load_bins(fin)
+
+    if prefilter == 'minhash':
+        pre_filtered_bins, skipped_bins = prefilter_bins_minhash(bins, num_perm=minhash_perm, num_bands=minhash_bands, threshold=minhash_threshold, num_workers=num_workers)
+    else:
+        pre_filtered_bins, skipped_bins = prefilter_bins(bins, dedup_ratio, debug=debug_skipped)
+    print("Original bins: %d, after filtering: %d, kept ratio: %.2f" % (len(bins), len(pre_filtered_bins), len(pre_filtered_bins) / len(bins)))
+    if skipped_out:
+        # (prog_name, counts or name lists) for names, (prog_name, kept prog_name) for minhash
+        with open(skipped_out, 'w') as fout:
+            json.dump(skipped_bins, fout)
+    del skipped_bins
+
+    train_bins, test_bins = split_bins(pre_filtered_bins)
+
+    train_store = normalize_bins(train_bins, 'Normalizing train dataset', num_workers=num_workers)
+    test_store = normalize_bins(test_bins, 'Normalizing test dataset', num_workers=num_workers)
+
+    print("Train bins: %d, Test bins: %d" % (len(train_bins), len(test_bins)))
+
+    train_name_list2funcs = index_train_funcs(train_bins)
+    train_body_index = index_train_bodies(train_bins, train_store)
+    test_overlaps, tier_counts = scan_leakage(test_bins, test_store, train_store, train_name_list2funcs, train_body_index, num_workers=num_workers)
+    for tier in ['exact', 'canonical', 'fuzzy']:
+        print("Resolved by %s: %d test functions, %d pairs" % (tier, tier_counts[tier]['funcs'], tier_counts[tier]['pairs']))
+
+    write_outputs(train_bins, test_bins, test_overlaps, train_out, test_out, test_overlap_out)
+    return train_bins, test_bins, test_overlaps
 
-with Pool(NUM_WORKERS) as p:
-    res = p.starmap(get_test_overlaps, intervals)
 
-test_overlaps = []
-for r in res:
-    test_overlaps.extend(r)
+def main():
+    args = parse_args()
+    run_pipeline(args.fin, args.dedup_ratio, args.train_out, args.test_out, args.test_overlap_out, num_workers=args.num_workers,
+                 prefilter=args.prefilter, minhash_perm=args.minhash_perm, minhash_bands=args.minhash_bands, minhash_threshold=args.minhash_threshold,
+                 skipped_out=args.skipped_out, debug_skipped=args.debug_skipped)
 
-new_ds_overlap = open(args.test_overlap_out_path, 'w')
-json.dump(test_overlaps, new_ds_overlap)
-new_ds_overlap.close()
 
-# output train and test dataset
-pickle.dump(train_bins, open(args.train_out_path, 'wb'))
-pickle.dump(test_bins, open(args.test_out_path, 'wb'))
-print("Output train dataset to %s, test dataset to %s" % (args.train_out_path, args.test_out_path))
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import re
+from collections import OrderedDict
 import cxxfilt
 
 # v1 v2 v4...
@@ -85,7 +86,7 @@ def is_interesting_func(func_entry):
     if not _is_interesting_function(gt_name):
         # dummy funcs inserted by compiler
         return False
-    if len(stripped_func['c'].split('\n')) < 4:
+    if stripped_func['c'].count('\n') < 3:
         # function with empty body
         return False
     
@@ -95,7 +96,28 @@ def is_interesting_func(func_entry):
 demangled_func_name_pattern = re.compile(r'.*([^0-9A-Za-z_~]|^)([~0-9a-zA-Z_]+)(<.*>)?(\[abi.*\])?\(.*\)')
 demangled_operator_name_pattern = re.compile(r'.*([^0-9A-Za-z_~]|^)(operator ?[^0-9a-zA-Z_]+|new|new\[\]|delete|delete\[\])(<.*>)?(\[abi.*\])?\(.*\)')
 
-def try_demangle(name, silent=False):
+# bounded LRU cache of name -> (result, demangled name, name) of _demangle
+DEMANGLE_CACHE_SIZE = 1 << 18
+_demangle_cache = OrderedDict()
+
+
+def _parse_demangled(name, demangled_name):
+  if name != demangled_name:    
+    matched = demangled_func_name_pattern.match(demangled_name)
+    if matched:
+      return matched.group(2), None, None
+    else:
+      matched = demangled_operator_name_pattern.match(demangled_name)
+      if matched:
+        return matched.group(2), None, None
+    # the demangled name and name are printed by try_demangle if not silent
+    return name, demangled_name, name
+    # raise Exception("Error parsing demangled name!")        
+  else:
+    return name, None, None
+
+
+def _demangle(name):
   try:
     demangled_name = cxxfilt.demangle(name)  
   except:
@@ -104,20 +126,40 @@ def try_demangle(name, silent=False):
     try:
         demangled_name = cxxfilt.demangle(name)
     except:
-        return name
-  if name != demangled_name:    
-    matched = demangled_func_name_pattern.match(demangled_name)
-    if matched:
-      return matched.group(2)
-    else:
-      matched = demangled_operator_name_pattern.match(demangled_name)
-      if matched:
-        return matched.group(2)
-    if not silent:
+        return name, None, None
+  return _parse_demangled(name, demangled_name)
+
+
+def _cache_put(name, entry):
+    _demangle_cache[name] = entry
+    if len(_demangle_cache) > DEMANGLE_CACHE_SIZE:
+        _demangle_cache.popitem(last=False)
+
+
+def _report(entry, silent):
+    result, demangled_name, name = entry
+    if demangled_name is not None and not silent:
         print("Error parsing demangled name: %s" % demangled_name)
         print("Original name: %s" % name)
-    return name
-    # raise Exception("Error parsing demangled name!")        
-  else:
-    return name
+    return result
+
+
+def try_demangle(name, silent=False):
+    entry = _demangle_cache.get(name)
+    if entry is None:
+        entry = _demangle(name)
+        _cache_put(name, entry)
+    else:
+        _demangle_cache.move_to_end(name)
+    return _report(entry, silent)
+
+
+def try_demangle_many(names, silent=False):
+    """
+    try_demangle over a list of names, demangling each distinct name once
+    """
+    for name in set(names):
+        if name not in _demangle_cache:
+            _cache_put(name, _demangle(name))
+    return [try_demangle(name, silent=silent) for name in names]
   
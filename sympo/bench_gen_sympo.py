@@ -0,0 +1,155 @@
+import argparse
+import json
+import random
+import time
+import gen_sympo
+
+
+WORDS = ["buf", "len", "count", "idx", "node", "list", "ptr", "size", "name", "file",
+         "ctx", "key", "value", "entry", "data", "result", "offset", "flags", "path", "str"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark SymPO generation stages")
+    parser.add_argument("--k", type=str, default="5,10,20,40", help="comma separated top-K sizes")
+    parser.add_argument("--num-entries", type=int, default=500)
+    parser.add_argument("--num-vars", type=int, default=6)
+    parser.add_argument("--num-funcs", type=int, default=2)
+    parser.add_argument("--use-gt", action="store_true")
+    parser.add_argument("--workers", type=str, default="", help="comma separated worker counts for a scaling report, e.g. 1,2,4,8")
+    parser.add_argument("--chunksize", type=int, default=0)
+    parser.add_argument("--skip-overfit", action="store_true", help="skip the tree-sitter filter stage")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json-out", type=str, default="")
+    args = parser.parse_args()
+    return args
+
+
+def _rand_name(rng):
+    return "%s_%s" % (rng.choice(WORDS), rng.choice(WORDS))
+
+
+def gen_entry(idx, k, num_vars, num_funcs, rng):
+    var_id_maps = {"v%d" % (i + 1): _rand_name(rng) for i in range(num_vars)}
+    func_id_maps = {"sub_%X" % (0x401000 + i * 0x40): _rand_name(rng) for i in range(num_funcs)}
+    lines = ["__int64 __fastcall sub_400000(__int64 a1)", "{"]
+    for var in var_id_maps:
+        lines.append("  __int64 %s; // rax" % var)
+    for func in func_id_maps:
+        lines.append("  v1 = %s(v2);" % func)
+    lines.append('  puts("%s");' % _rand_name(rng))
+    lines.append("  return v1;")
+    lines.append("}")
+    answer_and_probs = []
+    for _ in range(k):
+        preds = {}
+        for id, gt_name in list(var_id_maps.items()) + list(func_id_maps.items()):
+            # mostly noisy guesses, sometimes the ground truth
+            if rng.random() < 0.3:
+                preds[id] = gt_name
+            elif rng.random() < 0.95:
+                preds[id] = _rand_name(rng)
+        answer_and_probs.append((preds, rng.random()))
+    return {
+        "prog_name": "prog_%d" % idx,
+        "func_name": "sub_400000",
+        "var_id_maps": var_id_maps,
+        "func_id_maps": func_id_maps,
+        "answer_and_probs": answer_and_probs,
+        "ask_str": "<bos>" + "\n".join(lines) + "\n\n\nQ: what are the names?",
+    }
+
+
+class CallCounter:
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return self.fn(*args, **kwargs)
+
+
+def bench_k(k, args, config, rng):
+    entries = [gen_entry(i, k, args.num_vars, args.num_funcs, rng) for i in range(args.num_entries)]
+    result = {"k": k, "num_entries": len(entries)}
+
+    begin = time.perf_counter()
+    candidates = gen_sympo.find_sympo_candidates(entries)
+    seconds = time.perf_counter() - begin
+    result["candidates"] = {"seconds": seconds, "entries_per_sec": len(entries) / max(seconds, 1e-9), "num_out": len(candidates)}
+
+    counter = CallCounter(gen_sympo.score_name)
+    gen_sympo.score_name = counter
+    begin = time.perf_counter()
+    sympo_entries = []
+    for entry in candidates:
+        sympo_entries.extend(gen_sympo.get_sympo_entry(entry, config))
+    seconds = time.perf_counter() - begin
+    gen_sympo.score_name = counter.fn
+    result["scoring"] = {
+        "seconds": seconds,
+        "entries_per_sec": len(candidates) / max(seconds, 1e-9),
+        "num_out": len(sympo_entries),
+        "score_name_calls": counter.calls,
+        "score_name_calls_per_entry": counter.calls / max(len(candidates), 1),
+    }
+
+    if not args.skip_overfit and len(sympo_entries) > 0:
+        begin = time.perf_counter()
+        kept = gen_sympo.filter_entries(sympo_entries)
+        seconds = time.perf_counter() - begin
+        result["overfit_filter"] = {"seconds": seconds, "entries_per_sec": len(sympo_entries) / max(seconds, 1e-9), "num_out": len(kept)}
+    return result
+
+
+def bench_workers(worker_counts, args, config, rng):
+    """
+    run_get_sympo_entry on the same candidates for each worker count; the
+    output must not depend on it
+    """
+    k = int(args.k.split(",")[-1])
+    entries = [gen_entry(i, k, args.num_vars, args.num_funcs, rng) for i in range(args.num_entries)]
+    candidates = gen_sympo.find_sympo_candidates(entries)
+    results = []
+    reference = None
+    for num_workers in worker_counts:
+        begin = time.perf_counter()
+        out = gen_sympo.run_get_sympo_entry(candidates, config, num_workers=num_workers, chunksize=args.chunksize)
+        seconds = time.perf_counter() - begin
+        if reference is None:
+            reference = out
+        results.append({
+            "num_workers": num_workers,
+            "seconds": seconds,
+            "entries_per_sec": len(candidates) / max(seconds, 1e-9),
+            "same_output": out == reference,
+        })
+    return results
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    config = gen_sympo.SympoConfig(use_gt=args.use_gt, align_order=True, filter_data=False, func_prefix="sub_")
+
+    results = [bench_k(int(k), args, config, rng) for k in args.k.split(",")]
+    for r in results:
+        print("K=%d" % r["k"])
+        for stage in ["candidates", "scoring", "overfit_filter"]:
+            if stage not in r:
+                continue
+            print("  %-15s %10.1f entries/s  (%d out)" % (stage, r[stage]["entries_per_sec"], r[stage]["num_out"]))
+        print("  score_name calls per entry: %.1f" % r["scoring"]["score_name_calls_per_entry"])
+    if args.workers:
+        scaling = bench_workers([int(w) for w in args.workers.split(",")], args, config, rng)
+        base = scaling[0]["entries_per_sec"]
+        for r in scaling:
+            print("workers=%-3d %10.1f entries/s  speedup %.2f  same output: %s" % (r["num_workers"], r["entries_per_sec"], r["entries_per_sec"] / base, r["same_output"]))
+        results = {"stages": results, "scaling": scaling}
+    if args.json_out:
+        json.dump(results, open(args.json_out, "w"), indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,13 @@ import json
 import pickle
 from tqdm import tqdm
 from binary_prog import BinaryProgram, Function
-from name_utils import try_demangle
+from name_utils import try_demangle, try_demangle_many
 import numpy as np
 import os
 import argparse
+import time
+from collections import namedtuple
+from multiprocessing import Pool
 import datasets
 import torch
 from eval_utils import score_name
@@ -14,49 +17,83 @@ import tree_sitter
 import re
 from tree_sitter import Language, Parser
 import tree_sitter_utils as ts_utils
+import sympo_layout
 
 CPP_LANGUAGE = Language("tree-sitter-repos/build/my-languages.so", "cpp")
 C_LANGUAGE = Language("tree-sitter-repos/build/my-languages.so", "c")
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--train-ds-in",
-    type=str,
-    default="",
-)
-parser.add_argument(
-    "--use-gt",
-    action="store_true",
-)
-parser.add_argument("--align-order", type=bool, default=True)
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--train-ds-in",
+        type=str,
+        default="",
+    )
+    parser.add_argument(
+        "--use-gt",
+        action="store_true",
+    )
+    parser.add_argument("--align-order", type=bool, default=True)
 
-parser.add_argument(
-    "--filter-data",
-    action="store_true",
-)
+    parser.add_argument(
+        "--filter-data",
+        action="store_true",
+    )
 
 
-parser.add_argument("--tokenizer", type=str, default="google/codegemma-2b")
-parser.add_argument("--ghidra-mode", action="store_true")
-parser.add_argument("--sympo-ds-out", type=str, required=True)
-MAP_NUM_WORKER = 24
+    parser.add_argument("--tokenizer", type=str, default="google/codegemma-2b")
+    parser.add_argument("--ghidra-mode", action="store_true")
+    parser.add_argument("--sympo-ds-out", type=str, required=True)
+    parser.add_argument("--num-workers", type=int, default=MAP_NUM_WORKER)
+    parser.add_argument(
+        "--dedup-prompts",
+        action="store_true",
+        help="push each distinct input once as config 'prompts' and the entries referencing it as config 'entries'",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=0,
+        help="drop entries whose input plus longer answer exceed this many tokens, 0 keeps all",
+    )
+    parser.add_argument(
+        "--length-buckets",
+        type=str,
+        default="",
+        help="comma separated token length boundaries, e.g. 512,1024,2048; pushes one split per bucket",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=0,
+        help="candidates per worker task, 0 picks one from the number of candidates",
+    )
+    args = parser.parse_args()
+    return args
+
 
-args = parser.parse_args()
+MAP_NUM_WORKER = 24
 
+# set in main(), used by the overfit heuristic
 FUNC_PREFIX = "sub_"
-if args.ghidra_mode:
-    FUNC_PREFIX = "FUN_"
-    print("Using GHIDRA mode, prefix is FUN_")
-
-# Load the dataset
-train_ds_in = []
-for l in tqdm(open(args.train_ds_in, "r")):
-    try:
-        entry = json.loads(l) 
-        train_ds_in.append(entry)
-    except:
-        continue
+
+# options of get_sympo_entry, handed to each worker by _init_worker
+SympoConfig = namedtuple(
+    "SympoConfig", ["use_gt", "align_order", "filter_data", "func_prefix"]
+)
+
+
+def load_train_ds(path):
+    train_ds_in = []
+    for l in tqdm(open(path, "r")):
+        try:
+            entry = json.loads(l) 
+            train_ds_in.append(entry)
+        except:
+            continue
+    return train_ds_in
+
 
 #############################
 # find sympo candidates by two criteria:
@@ -64,35 +101,111 @@ for l in tqdm(open(args.train_ds_in, "r")):
 # 2. each sample has at least two different predictions
 #############################
 
-non_empty_train_samples = [s for s in train_ds_in if len(s["var_id_maps"]) > 0]
-
-sympo_candidates = []
-# make sure each sample has at least two different candidates
-for entry in tqdm(non_empty_train_samples):
-    var_ids = sorted(entry["var_id_maps"].keys())
-    name_list_set = set()
-    interesting_name_list = []
-    for preds, prob in entry["answer_and_probs"]:
-        pred_name_list = [preds[v] for v in var_ids if v in preds]
-        if len(pred_name_list) != len(var_ids):
+def find_sympo_candidates(train_ds_in):
+    non_empty_train_samples = [s for s in train_ds_in if len(s["var_id_maps"]) > 0]
+
+    sympo_candidates = []
+    # make sure each sample has at least two different candidates
+    for entry in tqdm(non_empty_train_samples):
+        var_ids = sorted(entry["var_id_maps"].keys())
+        name_list_set = set()
+        interesting_name_list = []
+        for preds, prob in entry["answer_and_probs"]:
+            pred_name_list = [preds[v] for v in var_ids if v in preds]
+            if len(pred_name_list) != len(var_ids):
+                continue
+            pred_names_str = "#".join(pred_name_list)
+            if pred_names_str not in name_list_set:
+                name_list_set.add(pred_names_str)
+                interesting_name_list.append(preds)
+        if len(interesting_name_list) > 1:
+            sympo_candidates.append(entry)
+    return sympo_candidates
+
+
+def _f1(gt_name, pred_name):
+    pr, rc = score_name(gt_name, pred_name)
+    if pr + rc < 0.001:
+        return 0
+    return 2 * pr * rc / (pr + rc)
+
+
+def build_score_matrix(answer_and_probs, name_map):
+    """
+    K x V F1 scores of each candidate's prediction for each id of `name_map`
+    against its ground truth name, the mask of the ids each candidate
+    predicts, and the predicted names. Repeated (id, prediction) pairs are
+    scored once.
+    """
+    scores = np.zeros((len(answer_and_probs), len(name_map)))
+    mask = np.zeros((len(answer_and_probs), len(name_map)), dtype=bool)
+    pred_names = [[None] * len(name_map) for _ in answer_and_probs]
+    f1_cache = {}
+    for r, (preds, prob) in enumerate(answer_and_probs):
+        for j, (id, gt_name) in enumerate(name_map):
+            if id not in preds:
+                continue
+            pred_name = preds[id]
+            key = (j, pred_name) if isinstance(pred_name, str) else None
+            if key is not None and key in f1_cache:
+                f1 = f1_cache[key]
+            else:
+                f1 = _f1(gt_name, pred_name)
+                if key is not None:
+                    f1_cache[key] = f1
+            scores[r, j] = f1
+            mask[r, j] = True
+            pred_names[r][j] = pred_name
+    return scores, mask, pred_names
+
+
+def _row_means(scores, mask, cols):
+    """
+    Mean over `cols` of the predicted scores of each row, 0 for rows that
+    predict none of them
+    """
+    sub_scores = scores[:, cols]
+    sub_mask = mask[:, cols]
+    counts = sub_mask.sum(axis=1)
+    means = [0] * len(scores)
+    full_rows = np.nonzero(counts == len(cols))[0]
+    if len(cols) > 0 and len(full_rows) > 0:
+        full_means = np.mean(sub_scores[full_rows], axis=1)
+        for r, m in zip(full_rows, full_means):
+            means[r] = m
+    for r in np.nonzero((counts > 0) & (counts < len(cols)))[0]:
+        means[r] = np.mean(sub_scores[r][sub_mask[r]])
+    return means
+
+
+def _interesting_vars(name_dict, row, scores, id2col, func_id_maps, gt_name_for_each_id, best_score_for_each_id, skip_vars):
+    interesting_vars = set()
+    for k, v in name_dict.items():
+        if k in skip_vars:
             continue
-        pred_names_str = "#".join(pred_name_list)
-        if pred_names_str not in name_list_set:
-            name_list_set.add(pred_names_str)
-            interesting_name_list.append(preds)
-    if len(interesting_name_list) > 1:
-        sympo_candidates.append(entry)
+        if k not in gt_name_for_each_id:
+            continue
+        if k not in best_score_for_each_id:
+            continue
+        if k in func_id_maps:
+            # scored against the demangled name, unlike the matrix
+            f1 = _f1(gt_name_for_each_id[k], v)
+        else:
+            f1 = scores[row, id2col[k]]
+        current_id_best = best_score_for_each_id[k]
+        if f1 + 0.1 < current_id_best:
+            interesting_vars.add(k)
+    return interesting_vars
 
 
-def get_sympo_entry(entry):
+def get_sympo_entry(entry, config):
     sympo_entries = []
     # first, collect the best name for each id
     best_name_for_each_id = {}
     best_score_for_each_id = {}
     gt_name_for_each_id = {}
-    name_list_score = []
     name_map = list(entry["var_id_maps"].items()) + list(entry["func_id_maps"].items())
-    if args.use_gt:
+    if config.use_gt:
         for id, gt_name in name_map:
             best_name_for_each_id[id] = gt_name
             if id in entry["func_id_maps"]:
@@ -105,39 +218,40 @@ def get_sympo_entry(entry):
             if id in entry["func_id_maps"]:
                 gt_name_for_each_id[id] = try_demangle(gt_name, silent=True)
 
-    for preds, prob in entry["answer_and_probs"]:
-        current_var_score_list = []
-        current_func_score_list = []
-        for id, gt_name in name_map:
-            if id not in preds:
-                continue
-            pred_name = preds[id]
-            pr, rc = score_name(gt_name, pred_name)
-            if pr + rc < 0.001:
-                f1 = 0
-            else:
-                f1 = 2 * pr * rc / (pr + rc)
-            if id not in best_score_for_each_id:
-                best_score_for_each_id[id] = 0
-                best_name_for_each_id[id] = ""
-            if f1 >= best_score_for_each_id[id]:
-                best_score_for_each_id[id] = f1
-                best_name_for_each_id[id] = pred_name
-            if not id.startswith(FUNC_PREFIX):
-                current_var_score_list.append(f1)
-            else:
-                current_func_score_list.append(f1)
-        if len(current_var_score_list) == 0:
-            avg_var_score = 0
-        else:
-            avg_var_score = np.mean(current_var_score_list)
-        if len(current_func_score_list) == 0:
-            avg_func_score = 0
-        else:
-            avg_func_score = np.mean(current_func_score_list)
-        name_list_score.append((preds, avg_var_score, avg_func_score))
+    answer_and_probs = entry["answer_and_probs"]
+    scores, mask, pred_names = build_score_matrix(answer_and_probs, name_map)
+    id2col = {id: j for j, (id, _) in enumerate(name_map)}
+    var_cols = [j for j, (id, _) in enumerate(name_map) if not id.startswith(config.func_prefix)]
+    func_cols = [j for j, (id, _) in enumerate(name_map) if id.startswith(config.func_prefix)]
+    avg_var_scores = _row_means(scores, mask, var_cols)
+    avg_func_scores = _row_means(scores, mask, func_cols)
+
+    # the best name of an id is its last prediction with the highest score,
+    # or the ground truth if --use-gt and no prediction scores as high
+    masked_scores = np.where(mask, scores, -np.inf)
+    col_max = masked_scores.max(axis=0) if len(answer_and_probs) > 0 else np.full(len(name_map), -np.inf)
+    if config.use_gt:
+        final_scores = np.maximum(col_max, 1)
+    else:
+        final_scores = col_max
+    hits = mask & (scores == final_scores)
+    has_hit = hits.any(axis=0)
+    last_hit = len(answer_and_probs) - 1 - np.argmax(hits[::-1], axis=0)
+    if not config.use_gt:
+        # ids enter the dicts in the order they are first predicted
+        first_row = np.argmax(mask, axis=0)
+        present = np.nonzero(mask.any(axis=0))[0]
+        order = present[np.lexsort((present, first_row[present]))]
+        for j in order:
+            best_score_for_each_id[name_map[j][0]] = 0
+            best_name_for_each_id[name_map[j][0]] = ""
+    for j, (id, _) in enumerate(name_map):
+        if has_hit[j]:
+            best_score_for_each_id[id] = final_scores[j]
+            best_name_for_each_id[id] = pred_names[last_hit[j]][j]
+
     var_best_scores = [
-        s for k, s in best_score_for_each_id.items() if not k.startswith(FUNC_PREFIX)
+        s for k, s in best_score_for_each_id.items() if not k.startswith(config.func_prefix)
     ]
     if len(var_best_scores) == 0:
         return sympo_entries
@@ -146,48 +260,30 @@ def get_sympo_entry(entry):
     if best_score < 0.2:
         return sympo_entries    
     # sort first by var score, then by func score, from low to high
-    sorted_name_list_score = sorted(name_list_score, key=lambda x: (x[1], x[2]))
+    sorted_rows = np.lexsort((np.array(avg_func_scores, dtype=float), np.array(avg_var_scores, dtype=float)))
     # everyone should align with the namemap order
-    if args.align_order:
+    if config.align_order:
         new_ordered_best_name = {}
         for k,v in name_map:
             if k in best_name_for_each_id:
                 new_ordered_best_name[k] = best_name_for_each_id[k]
         best_name_for_each_id = new_ordered_best_name
+    skip_vars = set(k for k, s in best_score_for_each_id.items() if s < 0.4)
     # pick the worst one
-    worst_name = sorted_name_list_score[0][0]
-    rejected_score = sorted_name_list_score[0][1]
+    worst_row = sorted_rows[0]
+    worst_name = answer_and_probs[worst_row][0]
+    rejected_score = avg_var_scores[worst_row]
     new_ordered_worst_name = {}
     for k, v in best_name_for_each_id.items():
         if k in worst_name:
             new_ordered_worst_name[k] = worst_name[k]
     should_skip = False
-    if args.align_order:
+    if config.align_order:
         worst_name = new_ordered_worst_name
         if len(worst_name) != len(best_name_for_each_id):
             should_skip = True
     if not should_skip:
-        skip_vars = set()
-        for k, s in best_score_for_each_id.items():
-            if s < 0.4:
-                skip_vars.add(k)
-        interesting_vars = set()
-        for k, v in worst_name.items():
-            if k in skip_vars:
-                continue
-            if k not in gt_name_for_each_id:
-                continue
-            if k not in best_score_for_each_id:
-                continue
-            pr, rc = score_name(gt_name_for_each_id[k], v)
-            if pr + rc < 0.001:
-                f1 = 0
-            else:
-                f1 = 2 * pr * rc / (pr + rc)
-            current_id_best = best_score_for_each_id[k]
-            if f1 + 0.1 < current_id_best:
-                interesting_vars.add(k)
-
+        interesting_vars = _interesting_vars(worst_name, worst_row, scores, id2col, entry["func_id_maps"], gt_name_for_each_id, best_score_for_each_id, skip_vars)
         sympo_entries.append(
             {
                 "prog_name": entry["prog_name"],
@@ -202,46 +298,28 @@ def get_sympo_entry(entry):
                 "interesting_vars": str(interesting_vars),
             }
         )
-    for i in range(1, len(sorted_name_list_score)):
-        best_name_combine = sorted_name_list_score[-i][0]
-        best_name_combine_score = sorted_name_list_score[-i][1]
+    for i in range(1, len(sorted_rows)):
+        combine_row = sorted_rows[-i]
+        best_name_combine = answer_and_probs[combine_row][0]
+        best_name_combine_score = avg_var_scores[combine_row]
         new_ordered_best_name_combine = {}
         for k, v in best_name_for_each_id.items():
             if k in best_name_combine:
                 new_ordered_best_name_combine[k] = best_name_combine[k]
-        if args.align_order:
+        if config.align_order:
             if len(new_ordered_best_name_combine) != len(best_name_for_each_id):
                 continue
-        if args.filter_data:
+        if config.filter_data:
             if best_name_combine_score >= best_score:
                 continue
         if (
             new_ordered_best_name_combine != new_ordered_worst_name
             and new_ordered_best_name_combine != best_name_for_each_id
         ):
-            if args.align_order:
+            if config.align_order:
                 best_name_combine = new_ordered_best_name_combine
             
-            skip_vars = set()
-            for k, s in best_score_for_each_id.items():
-                if s < 0.4:
-                    skip_vars.add(k)
-            interesting_vars = set()
-            for k, v in best_name_combine.items():
-                if k in skip_vars:
-                    continue
-                if k not in gt_name_for_each_id:
-                    continue
-                if k not in best_score_for_each_id:
-                    continue
-                pr, rc = score_name(gt_name_for_each_id[k], v)
-                if pr + rc < 0.001:
-                    f1 = 0
-                else:
-                    f1 = 2 * pr * rc / (pr + rc)
-                current_id_best = best_score_for_each_id[k]
-                if f1 + 0.1 < current_id_best:
-                    interesting_vars.add(k)
+            interesting_vars = _interesting_vars(best_name_combine, combine_row, scores, id2col, entry["func_id_maps"], gt_name_for_each_id, best_score_for_each_id, skip_vars)
             sympo_entries.append(
                 {
                     "prog_name": entry["prog_name"],
@@ -260,18 +338,85 @@ def get_sympo_entry(entry):
     return sympo_entries
 
 
-sympo_entries_global = []
-import multiprocessing
+_worker_config = None
+
+
+def _init_worker(config):
+    global _worker_config
+    _worker_config = config
+
+
+def _get_sympo_entry_worker(entry):
+    return get_sympo_entry(entry, _worker_config)
+
+
+def run_get_sympo_entry(sympo_candidates, config, num_workers=MAP_NUM_WORKER, chunksize=0):
+    """
+    get_sympo_entry over all candidates in `num_workers` processes. Results
+    keep the order of `sympo_candidates`, so runs are reproducible.
+    """
+    if chunksize <= 0:
+        chunksize = max(1, min(256, len(sympo_candidates) // (max(num_workers, 1) * 16)))
+    begin = time.time()
+    sympo_entries_global = []
+    if num_workers <= 1:
+        for entry in tqdm(sympo_candidates):
+            sympo_entries_global.extend(get_sympo_entry(entry, config))
+    else:
+        with Pool(num_workers, initializer=_init_worker, initargs=(config,)) as pool:
+            ret = pool.imap(_get_sympo_entry_worker, sympo_candidates, chunksize=chunksize)
+            for l in tqdm(ret, total=len(sympo_candidates)):
+                sympo_entries_global.extend(l)
+    seconds = time.time() - begin
+    print(
+        "Generated %d entries from %d candidates in %.1fs with %d workers (chunksize %d): %.1f candidates/s"
+        % (
+            len(sympo_entries_global),
+            len(sympo_candidates),
+            seconds,
+            num_workers,
+            chunksize,
+            len(sympo_candidates) / max(seconds, 1e-9),
+        )
+    )
+    return sympo_entries_global
+
 
-pool = multiprocessing.Pool(24)
+def get_callee_names(func_def, return_set=False):
+    func_calls = ts_utils.find_all_recursively(func_def, "call_expression")
+    callee_names = []
+    for call in func_calls:
+        callee_name = ts_utils.get_first_opt(call, "identifier")
+        if callee_name is not None:
+            callee_names.append(callee_name.text.decode("utf-8"))
+    if return_set:
+        return sorted(set(callee_names))
+    return sorted(callee_names)
 
-ret = pool.imap_unordered(get_sympo_entry, tqdm(sympo_candidates))
-for l in ret:
-    sympo_entries_global.extend(l)
 
+def heuristic_is_overfit(body):
+    cpp_parser = Parser()
+    cpp_parser.set_language(CPP_LANGUAGE)
+    root = cpp_parser.parse(bytes(body, "utf8"))
+    my_def = ts_utils.find_first_recursively_opt(
+        root.root_node, "function_definition"
+    )
+    if my_def is None:
+        return False
+    string_literals = ts_utils.find_all_recursively(my_def, "string_literal")
+    string_literals_value = [s.text.decode("utf-8") for s in string_literals]
+    interesting_strings = [s for s in string_literals_value if len(s) > 20]
+    if len(interesting_strings) > 1:
+        return False
+    callees = get_callee_names(my_def)
+    # how many 'sub_' functions are called
+    sub_count = len([c for c in callees if c.startswith(FUNC_PREFIX)])
+    if sub_count > len(callees) * 0.3:
+        return True
+    return False
 
-if args.filter_data:
 
+def filter_entries(sympo_entries_global):
     not_reasonable_entries = []
     resonable_entries = []
     for entry in sympo_entries_global:
@@ -280,38 +425,6 @@ if args.filter_data:
         else:
             resonable_entries.append(entry)
 
-    def get_callee_names(func_def, return_set=False):
-        func_calls = ts_utils.find_all_recursively(func_def, "call_expression")
-        callee_names = []
-        for call in func_calls:
-            callee_name = ts_utils.get_first_opt(call, "identifier")
-            if callee_name is not None:
-                callee_names.append(callee_name.text.decode("utf-8"))
-        if return_set:
-            return sorted(set(callee_names))
-        return sorted(callee_names)
-
-    def heuristic_is_overfit(body):
-        cpp_parser = Parser()
-        cpp_parser.set_language(CPP_LANGUAGE)
-        root = cpp_parser.parse(bytes(body, "utf8"))
-        my_def = ts_utils.find_first_recursively_opt(
-            root.root_node, "function_definition"
-        )
-        if my_def is None:
-            return False
-        string_literals = ts_utils.find_all_recursively(my_def, "string_literal")
-        string_literals_value = [s.text.decode("utf-8") for s in string_literals]
-        interesting_strings = [s for s in string_literals_value if len(s) > 20]
-        if len(interesting_strings) > 1:
-            return False
-        callees = get_callee_names(my_def)
-        # how many 'sub_' functions are called
-        sub_count = len([c for c in callees if c.startswith(FUNC_PREFIX)])
-        if sub_count > len(callees) * 0.3:
-            return True
-        return False
-
     overfits = []
     not_overfits = []
     for entry in tqdm(resonable_entries, desc="using heuristic to check overfits"):
@@ -330,10 +443,127 @@ if args.filter_data:
         "Non-Overfit entry number: %d (%.2f)"
         % (len(not_overfits), len(overfits) / len(sympo_entries_global))
     )
-    final_data = not_overfits
-else:
-    final_data = sympo_entries_global
+    return not_overfits
+
+
+TOKEN_LENGTH_FIELDS = ["input", "chosen", "rejected"]
+
+
+def add_token_lengths(dataset, tokenizer, num_proc=1):
+    """
+    Adds `<field>_num_tokens` for input/chosen/rejected and `num_tokens`,
+    the input plus the longer of the two answers. Fields are tokenized as in
+    training, with the tokenizer's default special tokens.
+    """
+
+    def _count(batch):
+        ret = {}
+        for field in TOKEN_LENGTH_FIELDS:
+            input_ids = tokenizer(batch[field])["input_ids"]
+            ret[field + "_num_tokens"] = [len(ids) for ids in input_ids]
+        ret["num_tokens"] = [
+            i + max(c, r)
+            for i, c, r in zip(
+                ret["input_num_tokens"],
+                ret["chosen_num_tokens"],
+                ret["rejected_num_tokens"],
+            )
+        ]
+        return ret
+
+    return dataset.map(
+        _count,
+        batched=True,
+        batch_size=1000,
+        num_proc=num_proc if num_proc > 1 else None,
+        desc="Tokenizing",
+    )
+
+
+def bucket_by_length(dataset, boundaries):
+    """
+    Splits named by the token length range of their entries: len_le_<b> for
+    each boundary b and len_gt_<last b> for the rest. Empty ranges get no
+    split.
+    """
+    num_tokens = np.array(dataset["num_tokens"])
+    buckets = {}
+    lower = -1
+    for boundary in boundaries:
+        indices = np.nonzero((num_tokens > lower) & (num_tokens <= boundary))[0]
+        if len(indices) > 0:
+            buckets["len_le_%d" % boundary] = dataset.select(indices)
+        lower = boundary
+    indices = np.nonzero(num_tokens > lower)[0]
+    if len(indices) > 0:
+        buckets["len_gt_%d" % lower] = dataset.select(indices)
+    return datasets.DatasetDict(buckets)
+
+
+def main():
+    global FUNC_PREFIX
+    args = parse_args()
+    if args.ghidra_mode:
+        FUNC_PREFIX = "FUN_"
+        print("Using GHIDRA mode, prefix is FUN_")
+
+    # Load the dataset
+    train_ds_in = load_train_ds(args.train_ds_in)
+    sympo_candidates = find_sympo_candidates(train_ds_in)
+    # demangle all function names in one batch; forked workers inherit the cache
+    try_demangle_many([gt_name for entry in sympo_candidates for gt_name in entry["func_id_maps"].values()], silent=True)
+
+    config = SympoConfig(
+        use_gt=args.use_gt,
+        align_order=args.align_order,
+        filter_data=args.filter_data,
+        func_prefix=FUNC_PREFIX,
+    )
+    sympo_entries_global = run_get_sympo_entry(
+        sympo_candidates, config, num_workers=args.num_workers, chunksize=args.chunksize
+    )
+
+    if args.filter_data:
+        final_data = filter_entries(sympo_entries_global)
+    else:
+        final_data = sympo_entries_global
+
+    dataset = datasets.Dataset.from_list(final_data)
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+    dataset = add_token_lengths(dataset, tokenizer, num_proc=args.num_workers)
+    if args.max_tokens > 0:
+        num_before = len(dataset)
+        dataset = dataset.filter(lambda n: n <= args.max_tokens, input_columns="num_tokens")
+        print(
+            "Dropped %d entries over %d tokens, %d left"
+            % (num_before - len(dataset), args.max_tokens, len(dataset))
+        )
+
+    if args.length_buckets:
+        boundaries = sorted(int(b) for b in args.length_buckets.split(","))
+        ds_buckets = bucket_by_length(dataset, boundaries)
+        for name, bucket in ds_buckets.items():
+            print("%s: %d entries" % (name, len(bucket)))
+        ds_shuffled = ds_buckets.shuffle(seed=42)
+    else:
+        ds_shuffled = dataset.shuffle(seed=42)
+    if args.dedup_prompts:
+        prompts, entries = sympo_layout.split_prompts(ds_shuffled)
+        print(
+            "%d distinct prompts, %.1f MB -> %.1f MB (prompts %.1f MB, entries %.1f MB)"
+            % (
+                len(prompts),
+                sympo_layout.dataset_nbytes(ds_shuffled) / 2**20,
+                (sympo_layout.dataset_nbytes(prompts) + sympo_layout.dataset_nbytes(entries)) / 2**20,
+                sympo_layout.dataset_nbytes(prompts) / 2**20,
+                sympo_layout.dataset_nbytes(entries) / 2**20,
+            )
+        )
+        prompts.push_to_hub(args.sympo_ds_out, config_name="prompts", private=True)
+        entries.push_to_hub(args.sympo_ds_out, config_name="entries", private=True)
+    else:
+        ds_shuffled.push_to_hub(args.sympo_ds_out, private=True)
+
 
-dataset = datasets.Dataset.from_list(final_data)
-ds_shuffled = dataset.shuffle(seed=42)
-ds_shuffled.push_to_hub(args.sympo_ds_out, private=True)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import datasets
+
+
+#############################
+# prompt-deduplicated SymPO layout:
+# "prompts": one row per distinct input, {"prompt_id", "input"}
+# "entries": the SymPO entries with "input" replaced by its "prompt_id"
+#############################
+
+PROMPT_FIELD = "input"
+
+
+def prompt_id(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _split_dataset(dataset, seen, prompt_ids, prompt_texts):
+    ids = []
+    for text in dataset[PROMPT_FIELD]:
+        pid = prompt_id(text)
+        ids.append(pid)
+        if pid not in seen:
+            seen.add(pid)
+            prompt_ids.append(pid)
+            prompt_texts.append(text)
+    return dataset.remove_columns(PROMPT_FIELD).add_column("prompt_id", ids)
+
+
+def split_prompts(dataset):
+    """
+    Returns the prompt table and the entries of a Dataset or DatasetDict;
+    the prompt table is shared by all splits of a DatasetDict
+    """
+    seen = set()
+    prompt_ids = []
+    prompt_texts = []
+    if isinstance(dataset, datasets.DatasetDict):
+        entries = datasets.DatasetDict(
+            {
+                name: _split_dataset(split, seen, prompt_ids, prompt_texts)
+                for name, split in dataset.items()
+            }
+        )
+    else:
+        entries = _split_dataset(dataset, seen, prompt_ids, prompt_texts)
+    prompts = datasets.Dataset.from_dict(
+        {"prompt_id": prompt_ids, PROMPT_FIELD: prompt_texts}
+    )
+    return prompts, entries
+
+
+def dataset_nbytes(dataset):
+    """
+    Arrow size of the rows of a Dataset, or of all splits of a DatasetDict.
+    A shuffled or selected dataset still points at its whole parent table,
+    so its rows are taken out first.
+    """
+    if isinstance(dataset, datasets.DatasetDict):
+        return sum(dataset_nbytes(split) for split in dataset.values())
+    return dataset.with_format("arrow")[:].nbytes
+
+
+class SympoRows:
+    """
+    Entries of the prompt-deduplicated layout with their input restored
+    when accessed. Inputs are fetched from the prompt table with one take
+    per batch of entries, through a prompt_id -> row index built once.
+    """
+
+    def __init__(self, prompts, entries, batch_size=1000):
+        self.prompts = prompts
+        self.entries = entries
+        self.batch_size = batch_size
+        self._prompt_id2row = None
+
+    def _prompt_rows(self, pids):
+        if self._prompt_id2row is None:
+            self._prompt_id2row = {
+                p: i for i, p in enumerate(self.prompts["prompt_id"])
+            }
+        return [self._prompt_id2row[pid] for pid in pids]
+
+    def prompts_of(self, pids):
+        """
+        Inputs of the prompt ids `pids`, in order
+        """
+        return self.prompts[self._prompt_rows(pids)][PROMPT_FIELD]
+
+    def prompt(self, pid):
+        return self.prompts_of([pid])[0]
+
+    def _restore(self, batch):
+        return {PROMPT_FIELD: self.prompts_of(batch["prompt_id"])}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        row = dict(self.entries[idx])
+        row[PROMPT_FIELD] = self.prompt(row.pop("prompt_id"))
+        return row
+
+    def __iter__(self):
+        for batch in self.entries.iter(batch_size=self.batch_size):
+            batch[PROMPT_FIELD] = self.prompts_of(batch.pop("prompt_id"))
+            for i in range(len(batch[PROMPT_FIELD])):
+                yield {k: v[i] for k, v in batch.items()}
+
+    def to_dataset(self):
+        """
+        All entries with their input, as a Dataset in the original layout
+        """
+        return self.entries.map(
+            self._restore,
+            batched=True,
+            batch_size=self.batch_size,
+            remove_columns=["prompt_id"],
+        )
+
+
+def load_sympo_layout(path, split="train"):
+    prompts = datasets.load_dataset(path, "prompts", split="train")
+    entries = datasets.load_dataset(path, "entries", split=split)
+    return SympoRows(prompts, entries)